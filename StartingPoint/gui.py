@@ -65,8 +65,34 @@ class LockView:
     def set_water_lvl(self, water_lvl):
         self.canvas.coords(self.middle_rectangle_id, 200*self.scale, (250-water_lvl/10)*self.scale, 400*self.scale, 250*self.scale)
 
+# Coalesces widget updates, so that the cost of redrawing does not depend on how many events the simulation produces.
+# An update (a function and its arguments) is not done right away, but stored under a key, replacing the earlier update with the same key, if any.
+# All stored updates are done at most 'fps' times per second, from tkinter's event loop.
+class RenderScheduler:
+    def __init__(self, toplevel, fps=30):
+        self.toplevel = toplevel
+        self.interval = max(1, int(1000 / fps)) # ms
+        self.dirty = {} # key -> (function, args, kwargs)
+        self.scheduled = False
+
+    # By default, the function itself is the key (bound methods of the same object are equal), so only its last update is done.
+    # Updates that overwrite each other's effect, should have the same key.
+    def update(self, function, *args, key=None, **kwargs):
+        self.dirty[function if key is None else key] = (function, args, kwargs)
+        if not self.scheduled:
+            self.scheduled = True
+            self.toplevel.after(self.interval, self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        dirty = self.dirty
+        self.dirty = {}
+        for function, args, kwargs in dirty.values():
+            function(*args, **kwargs)
+
 class GUI:
-    def __init__(self, sim, sc, wlvlsc, toplevel, randomseed=0):
+    # fps: how many times per second (at most) the widgets are updated
+    def __init__(self, sim, sc, wlvlsc, toplevel, randomseed=0, fps=30):
         # to raise input events
         self.sim = sim
         self.sc = sc
@@ -74,6 +100,8 @@ class GUI:
 
         self.rand = random.Random(randomseed) # seed
 
+        self.render = RenderScheduler(toplevel, fps)
+
         toplevel.resizable(0,0)
         toplevel.title("Lock Simulator")
 
@@ -143,38 +171,38 @@ class GUI:
     def set_doors(self, side, open):
         strval = "OPEN" if open else "CLOSED"
         if side == self.sc.LOW:
-            self.var_ldoors.set(strval)
-            self.lock_view.ldoor.set_doors(open)
+            self.render.update(self.var_ldoors.set, strval)
+            self.render.update(self.lock_view.ldoor.set_doors, open)
         elif side == self.sc.HIGH:
-            self.var_hdoors.set(strval)
-            self.lock_view.hdoor.set_doors(open)
+            self.render.update(self.var_hdoors.set, strval)
+            self.render.update(self.lock_view.hdoor.set_doors, open)
 
     def set_flow(self, side, open):
         strval = "OPEN" if open else "CLOSED"
         eventname = "open_flow" if open else "close_flow"
         self.sim.add_input_sync(self.wlvlsc, eventname, value=side)
         if side == self.sc.LOW:
-            self.var_lflow.set(strval)
-            self.lock_view.ldoor.set_flow(open)
+            self.render.update(self.var_lflow.set, strval)
+            self.render.update(self.lock_view.ldoor.set_flow, open)
         elif side == self.sc.HIGH:
-            self.var_hflow.set(strval)
-            self.lock_view.hdoor.set_flow(open)
+            self.render.update(self.var_hflow.set, strval)
+            self.render.update(self.lock_view.hdoor.set_flow, open)
 
     def set_green_light(self, side):
         if side == self.sc.LOW:
-            self.var_lsignal.set("GREEN")
-            self.lock_view.ldoor.set_green_light()
+            self.render.update(self.var_lsignal.set, "GREEN")
+            self.render.update(self.lock_view.ldoor.set_green_light, key=(self.lock_view.ldoor, "light"))
         else:
-            self.var_hsignal.set("GREEN")
-            self.lock_view.hdoor.set_green_light()
+            self.render.update(self.var_hsignal.set, "GREEN")
+            self.render.update(self.lock_view.hdoor.set_green_light, key=(self.lock_view.hdoor, "light"))
 
     def set_red_light(self, side):
         if side == self.sc.LOW:
-            self.var_lsignal.set("RED")
-            self.lock_view.ldoor.set_red_light()
+            self.render.update(self.var_lsignal.set, "RED")
+            self.render.update(self.lock_view.ldoor.set_red_light, key=(self.lock_view.ldoor, "light"))
         else:
-            self.var_hsignal.set("RED")
-            self.lock_view.hdoor.set_red_light()
+            self.render.update(self.var_hsignal.set, "RED")
+            self.render.update(self.lock_view.hdoor.set_red_light, key=(self.lock_view.hdoor, "light"))
 
     def break_sensor(self):
         self.sim.add_input_now(self.wlvlsc, "toggle_sensor_broken")
@@ -194,25 +222,28 @@ class GUI:
         self.var_sensor_status.set("NO FAILURE DETECTED")
 
     def set_request_pending(self, value):
+        # whether the button can be clicked, must not lag behind the statechart, only its text is coalesced
         if value:
-            self.button_change_lvl.config(state=tkinter.DISABLED, text="Change requested")
+            self.button_change_lvl.config(state=tkinter.DISABLED)
+            self.render.update(self.button_change_lvl.config, key=self.button_change_lvl, text="Change requested")
         else:
-            self.button_change_lvl.config(state=tkinter.NORMAL, text="Request water lvl change")
+            self.button_change_lvl.config(state=tkinter.NORMAL)
+            self.render.update(self.button_change_lvl.config, key=self.button_change_lvl, text="Request water lvl change")
 
     def on_water_level_reading(self, water_level):
         # the measured water level - can be nonsense if sensor is broken
         noisy_water_level = int(water_level + self.rand.random()*10)
         self.sim.add_input_sync(self.sc, "water_lvl", value=noisy_water_level)
-        self.var_sensor.set(noisy_water_level)
+        self.render.update(self.var_sensor.set, noisy_water_level)
 
     def on_real_water_level(self, water_level):
         # the actual water level
-        self.var_real_lvl.set(int(water_level))
-        self.lock_view.set_water_lvl(water_level)
+        self.render.update(self.var_real_lvl.set, int(water_level))
+        self.render.update(self.lock_view.set_water_lvl, water_level)
 
     def set_sensor_broken(self):
         self.button_resume.config(state=tkinter.NORMAL, bg='yellow')
         self.var_sensor_status.set("FAILURE DETECTED")
 
     def time_changed(self, simtime):
-        self.var_simtime.set(f'{simtime / 1000000000:.3f}')
+        self.render.update(self.var_simtime.set, f'{simtime / 1000000000:.3f}')
@@ -1,14 +1,22 @@
 # Author: Joeri Exelmans
 
+import heapq
+import math
+import types
+
 class QueueEntry:
-    __slots__ = ('timestamp', 'raise_method', 'value', 'canceled', 'event_name') # For MAXIMUM performance :)
+    __slots__ = ('timestamp', 'raise_method', 'value', 'sc', 'canceled', 'queued', 'period', 'stream', 'event_name') # For MAXIMUM performance :)
 
-    def __init__(self, timestamp, raise_method, value, event_name):
+    def __init__(self, timestamp, raise_method, value, event_name, sc=None):
         self.timestamp = timestamp
         self.raise_method = raise_method
         self.value = value
+        self.sc = sc if sc is not None else getattr(raise_method, '__self__', None) # statechart that receives the event
         self.event_name = event_name # name of the event - only needed for debugging
         self.canceled = False
+        self.queued = True # whether the entry is still in the event queue
+        self.period = None # if not None, the entry is put back into the event queue (with its timestamp incremented by 'period') every time it occurs
+        self.stream = None # InputStream that the entry came from, if any
 
     def __repr__(self):
         return f"({self.timestamp}, {self.event_name}, {self.value})"
@@ -16,65 +24,243 @@ class QueueEntry:
 # The main primitive for discrete event simulation.
 # An event queue / event loop, using virtualized (simulated) time, independent of wall clock time.
 class Controller:
-    def __init__(self):
+    # Canceled entries are not removed from the event queue right away (that would be O(n)).
+    # Instead, we count them, and once there are more than 'compaction_threshold' of them, and they make up at least half of the queue, the queue is rebuilt without them.
+    def __init__(self, compaction_threshold=1000):
+        # Binary heap of (timestamp, sequence_number, QueueEntry)-tuples.
+        # The sequence number breaks ties between equally-timestamped events, such that they occur in FIFO order (like a stable sort would do).
         self.event_queue = []
         self.simulated_time = 0
-        self.input_tracers = []
+        self.input_tracers = {} # statechart -> list of callbacks
+        # Incremented for every 'normal' event, decremented for every 'interrupt' event.
+        self.next_sequence_number = 0
+        self.next_interrupt_sequence_number = -1
+        self.compaction_threshold = compaction_threshold
+        self.num_canceled = 0 # number of canceled entries still in the event queue
+        # Objects (like lib.timing_wheel.TimingWheel) that hold entries outside of the event queue, and move them into the event queue before they are due.
+        # An event source has a 'num_pending' attribute, a 'horizon()' method that returns a lower bound on the timestamps of its pending entries, and a 'release_next()' method that moves (at least) its earliest pending entries into the event queue.
+        self.event_sources = []
+        self.sources_horizon = -math.inf # lower bound on the horizons of all event sources (horizons never decrease, so it stays valid until an event source is added)
+        self.stop_requested = False
+
+    # Makes run_until return right after the event that is currently being handled (e.g., when called from an output event callback or an input tracer)
+    def stop(self):
+        self.stop_requested = True
 
     # timestamp = absolute value, in simulated time (since beginning of simulation)
     def add_input(self, sc, event_name, timestamp, value=None):
-        if '.' in event_name:
-            interface, short_event_name = event_name.split('.')
-            raise_method = getattr(getattr(sc, interface), 'raise_' + short_event_name)
-        else:
-            raise_method = getattr(sc, 'raise_' + event_name)
-        self.add_input_lowlevel(timestamp, raise_method, value, event_name)
+        raise_method = get_raise_method(sc, event_name)
+        self.add_input_lowlevel(timestamp, raise_method, value, event_name, sc)
+
+    # Add many input events at once, e.g., an entire input trace of a test scenario.
+    # 'inputs' is an iterable of (timestamp, event_name, value)-tuples. Equally-timestamped events keep their order, and occur as if they had been added one-by-one with add_input, right now.
+    # Lists and tuples may be in any order. Any other iterable (e.g., a generator) must yield its events sorted by timestamp, and is consumed lazily, as the simulation progresses, so it can be arbitrarily large.
+    def add_inputs(self, sc, inputs):
+        if isinstance(inputs, (list, tuple)):
+            inputs = sorted(inputs, key=lambda tup: tup[0]) # stable, and linear time if already sorted
+            # fail now, rather than in the middle of the simulation:
+            for event_name in {event_name for (_, event_name, _) in inputs}:
+                get_raise_method(sc, event_name)
+        InputStream(self, sc, inputs)
 
     # time_offset = relative to current simulated time
     def add_input_relative(self, sc, event_name, time_offset=0, value=None):
         timestamp = self.simulated_time + time_offset
         return self.add_input(sc, event_name, timestamp, value)
 
-    def add_input_lowlevel(self, timestamp, raise_method, value, event_name):
-        e = QueueEntry(timestamp, raise_method, value, event_name)
-        self.event_queue.append(e)
-        # important to use a stable sorting algorithm here,
-        # so the order between equally-timestamped events is preserved:
-        self.event_queue.sort(key = lambda entry: entry.timestamp)
+    def add_input_lowlevel(self, timestamp, raise_method, value, event_name, sc=None):
+        e = QueueEntry(timestamp, raise_method, value, event_name, sc)
+        # the added event will occur AFTER equally-timestamped events that were already in the queue
+        heapq.heappush(self.event_queue, (timestamp, self.next_sequence_number, e))
+        self.next_sequence_number += 1
         return e
 
     # difference here is that the added event will occur BEFORE equally-timestamped events that were already in the queue
-    def add_input_lowlevel_interrupt(self, timestamp, raise_method, value, event_name):
-        e = QueueEntry(timestamp, raise_method, value, event_name)
-        self.event_queue.insert(0, e)
-        self.event_queue.sort(key = lambda entry: entry.timestamp)
+    def add_input_lowlevel_interrupt(self, timestamp, raise_method, value, event_name, sc=None):
+        e = QueueEntry(timestamp, raise_method, value, event_name, sc)
+        heapq.heappush(self.event_queue, (timestamp, self.next_interrupt_sequence_number, e))
+        self.next_interrupt_sequence_number -= 1
         return e
 
+    # Callback will be called with (timestamp, event_name, value) for every input event of statechart 'sc', right before it occurs
+    def register_input_tracer(self, sc, callback):
+        self.input_tracers.setdefault(sc, []).append(callback)
+
+    def unregister_input_tracer(self, sc, callback):
+        callbacks = self.input_tracers[sc]
+        callbacks.remove(callback)
+        if not callbacks:
+            del self.input_tracers[sc]
+
+    # Cancel an entry that was returned by one of the add_input_lowlevel*-methods.
+    # Canceling an entry that has already occurred (or was already canceled) has no effect, except for a periodic entry that is occurring right now: it does not occur again.
+    def cancel(self, e):
+        if not e.canceled:
+            e.canceled = True
+            if e.queued:
+                self.num_canceled += 1
+                if self.num_canceled > self.compaction_threshold and self.num_canceled * 2 >= len(self.event_queue):
+                    self.compact()
+
+    # Remove all canceled entries from the event queue
+    def compact(self):
+        live = []
+        for tup in self.event_queue:
+            if tup[2].canceled:
+                tup[2].queued = False
+            else:
+                live.append(tup)
+        heapq.heapify(live)
+        self.event_queue[:] = live # mutate in-place
+        self.num_canceled = 0
+
+    # Pop canceled entries at the front of the event queue, so that the earliest entry is one that will actually occur
+    def discard_canceled_heads(self):
+        event_queue = self.event_queue
+        while event_queue and event_queue[0][2].canceled:
+            heapq.heappop(event_queue)[2].queued = False
+            self.num_canceled -= 1
+
+    def add_event_source(self, source):
+        self.event_sources.append(source)
+        self.sources_horizon = -math.inf
+
+    # Move entries from the event sources into the event queue, until no event source can have an entry that is due at or before 'until', and before the earliest entry in the event queue
+    def release_from_sources(self, until):
+        event_queue = self.event_queue
+        for source in self.event_sources:
+            while source.num_pending:
+                horizon = source.horizon()
+                if horizon > until:
+                    break
+                self.discard_canceled_heads()
+                if event_queue and horizon > event_queue[0][0]:
+                    break
+                source.release_next()
+        self.sources_horizon = min((source.horizon() for source in self.event_sources), default=math.inf)
+
     # Runs simulation as-fast-as-possible, until 'until'-timestamp (in simulated time)
     # blocking, synchronous function
     def run_until(self, until):
         # print('running until', pretty_time(until))
-        while self.have_event() and self.get_earliest() <= until:
-            e = self.event_queue[0]
-            for sc, tracer in self.input_tracers:
-                if sc == e.raise_method.__self__:
+        event_queue = self.event_queue # the heap is only ever mutated in-place
+        input_tracers = self.input_tracers
+        while not self.stop_requested:
+            # only look at the event sources if they can have an entry that is due before the earliest entry in the event queue:
+            if self.event_sources and self.sources_horizon <= until and (not event_queue or self.sources_horizon <= event_queue[0][0]):
+                self.release_from_sources(until)
+            if not event_queue or event_queue[0][0] > until:
+                break
+            e = event_queue[0][2]
+            if e.stream is not None:
+                # may raise ValueError, in which case 'e' stays in the event queue
+                e.stream.prepare_next(e.timestamp)
+            heapq.heappop(event_queue)
+            e.queued = False
+            if e.stream is not None:
+                e.stream.release_next()
+            if e.canceled:
+                # unlike in earlier versions, canceled entries (i.e., timers that were unset) are not passed to the input tracers, so a verbose Tracer no longer prints them
+                self.num_canceled -= 1
+                continue
+            if input_tracers and e.sc in input_tracers:
+                for tracer in input_tracers[e.sc]:
                     tracer(e.timestamp, e.event_name, e.value)
-            # e = self.event_queue.pop();
-            self.event_queue = self.event_queue[1:]
-            if not e.canceled:
-                self.simulated_time = e.timestamp
-                if e.value == None:
-                    e.raise_method()
-                else:
-                    e.raise_method(e.value)
+            self.simulated_time = e.timestamp
+            if e.value == None:
+                e.raise_method()
+            else:
+                e.raise_method(e.value)
+            if e.period is not None and not e.canceled:
+                # re-use the same entry for the next occurrence.
+                # Its sequence number is taken after the event has been handled, so it occurs after the equally-timestamped events that were added while handling it, like a one-shot timer that is re-armed at the end of the step would.
+                e.timestamp += e.period
+                e.queued = True
+                heapq.heappush(event_queue, (e.timestamp, self.next_sequence_number, e))
+                self.next_sequence_number += 1
+        self.stop_requested = False
 
+    # Canceled entries are not taken into account:
     def have_event(self):
-        return len(self.event_queue) > 0
+        self.discard_canceled_heads()
+        return len(self.event_queue) > 0 or any(source.num_pending for source in self.event_sources)
 
     def get_earliest(self):
-        # return self.event_queue[-1].timestamp
-        return self.event_queue[0].timestamp
+        self.release_from_sources(math.inf)
+        self.discard_canceled_heads()
+        return self.event_queue[0][0]
+
+
+# Lazily moves the events of a timestamp-sorted iterable into the event queue of a Controller, one at a time:
+# the next event is only put in the event queue when the previous one occurs.
+# Therefore, all its entries can share the same sequence number, reserved when the stream was created.
+class InputStream:
+    def __init__(self, controller: Controller, sc, inputs):
+        self.controller = controller
+        self.sc = sc
+        self.iterator = iter(inputs)
+        self.raise_methods = {} # event_name -> raise method, so every event name is only resolved once
+        self.next_input = None # (timestamp, event_name, value)-tuple read from the iterator, but not checked yet
+        self.next_entry = None # checked entry, to be put in the event queue by release_next
+        self.sequence_number = controller.next_sequence_number
+        controller.next_sequence_number += 1
+        self.prepare_next()
+        self.release_next()
+
+    # Called by the Controller when our previous entry is about to occur, before it is taken out of the event queue.
+    # Reads and checks the next event. If it is invalid, ValueError is raised, and raised again by every subsequent call.
+    def prepare_next(self, previous_timestamp=None):
+        if self.next_entry is not None:
+            return
+        if self.next_input is None:
+            self.next_input = next(self.iterator, None)
+            if self.next_input is None:
+                return # exhausted
+        timestamp, event_name, value = self.next_input
+        if previous_timestamp is not None and timestamp < previous_timestamp:
+            raise ValueError(f"Input events must be sorted by timestamp, but {self.next_input} comes after an event at {previous_timestamp}")
+        try:
+            raise_method = self.raise_methods[event_name]
+        except KeyError:
+            raise_method = self.raise_methods[event_name] = get_raise_method(self.sc, event_name)
+        e = QueueEntry(timestamp, raise_method, value, event_name, self.sc)
+        e.stream = self
+        self.next_entry = e
+        self.next_input = None
+
+    # Called by the Controller when our previous entry occurs
+    def release_next(self):
+        e = self.next_entry
+        if e is not None:
+            self.next_entry = None
+            heapq.heappush(self.controller.event_queue, (e.timestamp, self.sequence_number, e))
+
+# (statechart class, event name) -> (interface attribute name or None, unbound raise function)
+raise_function_cache = {}
+
+# event_name is either the name of an input event of 'sc', or '<interface>.<event name>'
+# Raises ValueError if the statechart has no such input event.
+def get_raise_method(sc, event_name):
+    try:
+        interface, raise_function = raise_function_cache[(type(sc), event_name)]
+    except KeyError:
+        interface, raise_function = raise_function_cache[(type(sc), event_name)] = resolve_raise_function(sc, event_name)
+    if interface is None:
+        return types.MethodType(raise_function, sc)
+    else:
+        return types.MethodType(raise_function, getattr(sc, interface))
 
+def resolve_raise_function(sc, event_name):
+    if '.' in event_name:
+        interface, short_event_name = event_name.split('.', 1)
+        target = getattr(sc, interface, None)
+    else:
+        interface, short_event_name = None, event_name
+        target = sc
+    raise_function = getattr(type(target), 'raise_' + short_event_name, None)
+    if target is None or raise_function is None:
+        raise ValueError(f"Statechart {type(sc).__name__} has no input event '{event_name}'")
+    return (interface, raise_function)
 
 def pretty_time(time_ns):
     return f'{round(time_ns / 1000000000, 3)} s'
@@ -0,0 +1,150 @@
+# Diff of two sequences (e.g., event traces) of hashable items, in (near) linear time for the traces we compare in practice.
+#
+# Like 'patience diff': after stripping the common prefix and suffix, items that occur exactly once in both sequences are used as anchors (their longest common subsequence is found in O(n log n)), and the parts between anchors are diffed recursively.
+# Because events are timestamped, almost every event is unique, so the anchors do nearly all of the work.
+# Parts without unique items are diffed with Myers' O((N+M)D) algorithm, if they are small enough, or else shown as removed and added as a whole.
+
+import bisect
+
+MAX_MYERS_LENGTH = 2000 # max. N+M of a part that is diffed with Myers' algorithm
+MAX_DEPTH = 100 # max. nesting of anchor searches (to stay far from Python's recursion limit)
+
+# Returns a list of (symbol, item), where symbol is ' ' (in both sequences), '-' (only in a) or '+' (only in b).
+def diff(a, b):
+    ops = []
+    diff_range(a, 0, len(a), b, 0, len(b), ops)
+    return ops
+
+def diff_range(a, alo, ahi, b, blo, bhi, ops, depth=0):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        ops.append((' ', a[alo]))
+        alo += 1
+        blo += 1
+    suffix_start = ahi
+    while ahi > alo and bhi > blo and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+
+    if alo == ahi or blo == bhi:
+        ops.extend(('-', a[i]) for i in range(alo, ahi))
+        ops.extend(('+', b[j]) for j in range(blo, bhi))
+    else:
+        anchors = unique_common_subsequence(a, alo, ahi, b, blo, bhi) if depth < MAX_DEPTH else []
+        if anchors:
+            for i, j in anchors:
+                diff_range(a, alo, i, b, blo, j, ops, depth + 1)
+                ops.append((' ', a[i]))
+                alo, blo = i + 1, j + 1
+            diff_range(a, alo, ahi, b, blo, bhi, ops, depth + 1)
+        elif (ahi - alo) + (bhi - blo) <= MAX_MYERS_LENGTH:
+            myers(a, alo, ahi, b, blo, bhi, ops)
+        else:
+            ops.extend(('-', a[i]) for i in range(alo, ahi))
+            ops.extend(('+', b[j]) for j in range(blo, bhi))
+
+    ops.extend((' ', a[i]) for i in range(ahi, suffix_start))
+
+# Returns the longest list of index pairs (i, j), increasing in both i and j, such that a[i] == b[j] occurs exactly once in a[alo:ahi] and exactly once in b[blo:bhi]
+def unique_common_subsequence(a, alo, ahi, b, blo, bhi):
+    counts = {}
+    for i in range(alo, ahi):
+        item = a[i]
+        counts[item] = i if item not in counts else None
+    matches = {}
+    for j in range(blo, bhi):
+        item = b[j]
+        if counts.get(item) is not None:
+            matches[item] = j if item not in matches else None
+    pairs = [(counts[item], j) for item, j in matches.items() if j is not None]
+    if not pairs:
+        return []
+    pairs.sort()
+    # longest increasing subsequence of the j's (patience sorting):
+    tails = [] # tails[k] = smallest j that ends an increasing subsequence of length k+1
+    tail_indices = []
+    predecessors = [None] * len(pairs)
+    for index, (i, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[k] = j
+            tail_indices[k] = index
+        predecessors[index] = tail_indices[k - 1] if k > 0 else None
+    result = []
+    index = tail_indices[-1]
+    while index is not None:
+        result.append(pairs[index])
+        index = predecessors[index]
+    result.reverse()
+    return result
+
+# Myers' greedy algorithm, finds a shortest edit script
+def myers(a, alo, ahi, b, blo, bhi, ops):
+    n = ahi - alo
+    m = bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1] # move down: insertion
+            else:
+                x = v[k - 1] + 1 # move right: deletion
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return myers_backtrack(a, alo, b, blo, trace, n, m, ops)
+
+def myers_backtrack(a, alo, b, blo, trace, x, y, ops):
+    reversed_ops = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[previous_k]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            reversed_ops.append((' ', a[alo + x]))
+        if d > 0:
+            if x == previous_x:
+                reversed_ops.append(('+', b[blo + previous_y]))
+            else:
+                reversed_ops.append(('-', a[alo + previous_x]))
+        x, y = previous_x, previous_y
+    ops.extend(reversed(reversed_ops))
+
+# Only keeps the ops around the first 'max_divergences' blocks of consecutive differences, with 'context' unchanged items before and after every block.
+# Yields the kept ops, and None in place of every run of dropped ops.
+def window(ops, max_divergences, context=3):
+    keep = [False] * len(ops)
+    num_divergences = 0
+    i = 0
+    while i < len(ops) and num_divergences < max_divergences:
+        if ops[i][0] == ' ':
+            i += 1
+            continue
+        start = i
+        while i < len(ops) and ops[i][0] != ' ':
+            i += 1
+        for index in range(max(0, start - context), min(len(ops), i + context)):
+            keep[index] = True
+        num_divergences += 1
+    dropped = False
+    for op, kept in zip(ops, keep):
+        if kept:
+            dropped = False
+            yield op
+        elif not dropped:
+            dropped = True
+            yield None
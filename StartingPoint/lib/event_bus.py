@@ -0,0 +1,43 @@
+from lib.controller import Controller, get_raise_method
+from lib.yakindu.rx import Observer
+
+# Connects output events of statecharts to input events of (other) statecharts that run on the same Controller.
+# When the source statechart raises the output event, the input event is added to the event queue at the current simulated time (after the events that are already queued for that time), exactly like EventLoopRealTimeSimulation.add_input_sync does.
+# This way, a closed loop of statecharts (e.g., a controller and a model of its environment) can run without any GUI, as fast as possible.
+class EventBus:
+    def __init__(self, controller: Controller):
+        self.controller = controller
+        self.num_routed = 0 # number of events routed so far
+
+    # Every time 'source' raises 'output_event', 'target' receives 'input_event', with the same parameter value, or with transform(value) if 'transform' is given.
+    # If 'delay' (simulated time) is given, 'target' receives the event that much later (e.g., to model transport delays).
+    # Event names are either plain names, or '<interface>.<event name>'.
+    def connect(self, source, output_event, target, input_event, transform=None, delay=0):
+        raise_method = get_raise_method(target, input_event) # fails now, rather than during the simulation
+        get_observable(source, output_event).subscribe(Route(self, raise_method, input_event, target, transform, delay))
+
+def get_observable(sc, event_name):
+    obj = sc
+    if '.' in event_name:
+        interface, event_name = event_name.split('.', 1)
+        obj = getattr(sc, interface)
+    observable = getattr(obj, event_name + '_observable', None)
+    if observable is None:
+        raise ValueError(f"Statechart {type(sc).__name__} has no output event '{event_name}'")
+    return observable
+
+class Route(Observer):
+    def __init__(self, bus, raise_method, event_name, target, transform, delay=0):
+        self.bus = bus
+        self.raise_method = raise_method
+        self.event_name = event_name
+        self.target = target
+        self.transform = transform
+        self.delay = delay
+
+    def next(self, value=None):
+        if self.transform is not None:
+            value = self.transform(value)
+        controller = self.bus.controller
+        controller.add_input_lowlevel(controller.simulated_time + self.delay, self.raise_method, value, self.event_name, self.target)
+        self.bus.num_routed += 1
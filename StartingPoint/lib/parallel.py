@@ -0,0 +1,377 @@
+import ast
+import copy
+import inspect
+import math
+import multiprocessing
+import struct
+import textwrap
+import traceback
+from multiprocessing import shared_memory
+
+from lib.controller import Controller, get_raise_method
+from lib.event_bus import EventBus, get_observable
+from lib.trace_file import NONE, BOOL, INT, FLOAT
+from lib.tracer import Tracer
+from lib.yakindu.rx import Observer
+from lib.yakindu_helpers import trace_output_events
+
+# Parallel discrete-event co-simulation: every group of statecharts ("process") runs in an OS process of its own, on a Controller of its own, and the processes exchange timestamped events over shared-memory channels.
+#
+# Synchronization is conservative (Chandy-Misra-Bryant): a process only handles events that no other process can still precede.
+# Besides the events themselves, every process sends 'promises' (null messages) to the processes that it is connected to: a promise P means that the process will not send any more events that it creates before simulated time P.
+# A process can promise more than the time of its own earliest event, if its statecharts do not react right away to events from other processes: its 'lookahead' is a lower bound on the delay between such an event and any output event that it causes (e.g., shortest_timer(WaterLevelSimulator), because the WaterLevelSimulator only raises output events when a timer expires, or when it receives an input event of its own).
+# Every cycle of connected processes must have some lookahead (or delay), otherwise the processes wait for each other forever.
+#
+# Equally-timestamped events occur in the same order as in a single-process run (run_sequential), as long as no process receives equally-timestamped events that were created at the same simulated time by different senders (other processes, or the process itself).
+# This holds, e.g., for LockController and WaterLevelSimulator in separate processes, and for several of those pairs connected with a delay (see runner_parallel.py).
+# Timestamps, delays and lookaheads must be integers (nanoseconds, fitting in 64 bits): a process handles everything before a time T by running until T - 1.
+#
+# Typical usage:
+#   cosim = CoSimulation()
+#   cosim.add_process("lock", ["lock"], build_lock_controller)
+#   cosim.add_process("water_level", ["wlvl"], build_water_level_simulator, lookahead=shortest_timer(WaterLevelSimulator))
+#   cosim.connect("lock", "open_flow", "wlvl", "open_flow")
+#   ...
+#   traces = cosim.run_parallel(until)
+class CoSimulation:
+    def __init__(self):
+        self.processes = [] # ProcessSpec
+        self.connections = [] # (source, output_event, target, input_event, transform, delay)-tuples, with statechart names
+
+    # build(controller, *args) is called in the process that will run the statecharts. It returns a dict of statechart name -> statechart, with timer services set and input events added, but not entered yet.
+    # 'statechart_names' are the names of the statecharts that build returns, which must be unique among all processes.
+    # 'args' and the functions must be picklable (e.g., module-level functions).
+    def add_process(self, name, statechart_names, build, args=(), lookahead=0):
+        self.processes.append(ProcessSpec(name, statechart_names, build, args, lookahead))
+
+    # Like EventBus.connect, with statechart names instead of statecharts
+    def connect(self, source, output_event, target, input_event, transform=None, delay=0):
+        self.connections.append((source, output_event, target, input_event, transform, delay))
+
+    # Statechart name -> index of its process
+    def get_process_indices(self):
+        process_indices = {}
+        for i, spec in enumerate(self.processes):
+            for sc_name in spec.statechart_names:
+                if sc_name in process_indices:
+                    raise ValueError(f"Statechart name '{sc_name}' is used by more than one process")
+                process_indices[sc_name] = i
+        return process_indices
+
+    # Runs all statecharts in this process, on one Controller, connected by an EventBus.
+    # Returns a dict of statechart name -> scenario (with the input and output events of the statechart, like the scenarios in runner_tests.py).
+    def run_sequential(self, until):
+        controller = Controller()
+        statecharts = {}
+        for spec in self.processes:
+            statecharts.update(spec.build_statecharts(controller))
+        tracers = trace_statecharts(controller, statecharts)
+        bus = EventBus(controller)
+        for source, output_event, target, input_event, transform, delay in self.connections:
+            bus.connect(statecharts[source], output_event, statecharts[target], input_event, copy.deepcopy(transform), delay)
+        for sc in statecharts.values():
+            sc.enter()
+        controller.run_until(until)
+        return get_scenarios(tracers)
+
+    # Runs every process in an OS process of its own, and returns the same as run_sequential.
+    # 'channel_capacity' is the number of messages that fit in a channel (from one process to another) before the sender has to wait.
+    def run_parallel(self, until, channel_capacity=4096):
+        check_timestamp(until, "'until'")
+        for spec in self.processes:
+            if spec.lookahead != math.inf:
+                check_timestamp(spec.lookahead, f"Lookahead of process '{spec.name}'")
+        for source, output_event, target, input_event, transform, delay in self.connections:
+            check_timestamp(delay, f"Delay of the connection from '{source}.{output_event}' to '{target}.{input_event}'")
+        process_indices = self.get_process_indices()
+        logical_processes = [LogicalProcess(spec) for spec in self.processes]
+        channels = {} # (source process index, target process index) -> Channel
+        try:
+            for source, output_event, target, input_event, transform, delay in self.connections:
+                key = (process_indices[source], process_indices[target])
+                channel = channels.get(key)
+                if channel is None:
+                    channel = channels[key] = Channel(channel_capacity, logical_processes[key[1]].doorbell)
+                    logical_processes[key[0]].output_channels.append(channel)
+                    logical_processes[key[1]].input_channels.append(channel)
+                logical_processes[key[0]].routes.append((source, output_event, channel, len(channel.routes), transform))
+                channel.routes.append((target, input_event, delay))
+
+            connections = []
+            processes = []
+            for lp in logical_processes:
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=lp.run, args=(until, sender), name=lp.name, daemon=True)
+                process.start()
+                sender.close()
+                connections.append(receiver)
+                processes.append(process)
+
+            scenarios = {}
+            try:
+                for lp, receiver in zip(logical_processes, connections):
+                    try:
+                        ok, result = receiver.recv()
+                    except EOFError:
+                        raise RuntimeError(f"Process '{lp.name}' died")
+                    if not ok:
+                        raise RuntimeError(f"Process '{lp.name}' failed:\n{result}")
+                    scenarios.update(result)
+            except:
+                for process in processes:
+                    process.terminate()
+                raise
+            finally:
+                for process in processes:
+                    process.join()
+            return scenarios
+        finally:
+            for channel in channels.values():
+                channel.unlink()
+
+class ProcessSpec:
+    def __init__(self, name, statechart_names, build, args, lookahead):
+        self.name = name
+        self.statechart_names = list(statechart_names)
+        self.build = build
+        self.args = args
+        self.lookahead = lookahead
+
+    def build_statecharts(self, controller):
+        statecharts = self.build(controller, *self.args)
+        if sorted(statecharts) != sorted(self.statechart_names):
+            raise ValueError(f"Process '{self.name}' built statecharts {sorted(statecharts)}, but was added with {sorted(self.statechart_names)}")
+        return statecharts
+
+# Raises ValueError if 'timestamp' (or a duration) is not an int64
+def check_timestamp(timestamp, what):
+    if type(timestamp) is not int or not -2**63 <= timestamp <= NEVER:
+        raise ValueError(f"{what} must be an int64 (nanoseconds) in a parallel co-simulation, not {timestamp!r}")
+
+def trace_statecharts(controller, statecharts):
+    tracers = {}
+    for sc_name, sc in statecharts.items():
+        tracer = tracers[sc_name] = Tracer(verbose=False)
+        controller.register_input_tracer(sc, tracer.record_input_event)
+        trace_output_events(controller, sc, callback=tracer.record_output_event)
+    return tracers
+
+def get_scenarios(tracers):
+    return {sc_name: {"name": sc_name, "input_events": tracer.input_events, "output_events": tracer.output_events} for sc_name, tracer in tracers.items()}
+
+# Returns the duration of the shortest timer (in nanoseconds) that the (generated) code of a statechart class sets, or math.inf if it has no timers.
+def shortest_timer(statechart_class):
+    tree = ast.parse(textwrap.dedent(inspect.getsource(statechart_class)))
+    durations = [evaluate_constant(node.args[2]) for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'set_timer']
+    return math.floor(min(durations) * 1000000) if durations else math.inf # ms to ns, rounded down to keep it a lower bound
+
+def evaluate_constant(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -evaluate_constant(node.operand)
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return BINARY_OPERATORS[type(node.op)](evaluate_constant(node.left), evaluate_constant(node.right))
+    raise ValueError(f"Timer duration is not a constant: {ast.unparse(node)}")
+
+BINARY_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+}
+
+# message kinds
+EVENT = 0
+PROMISE = 1
+
+NEVER = 2**63 - 1 # promise of a process that will not send any more events
+
+# kind, value type, route id, timestamp (creation time of the event, or promise), value (int64, or float64 at the same offset)
+RECORD = struct.Struct("<BBxxIqq")
+FLOAT_VALUE = struct.Struct("<d")
+FLOAT_VALUE_OFFSET = 16
+
+# Single-producer, single-consumer queue of messages from one process to another, in a ring buffer in shared memory.
+# Two semaphores count the messages and the free slots; besides letting the processes wait for each other, they make sure that the receiver sees a message only after it has been written completely.
+# Every message also releases the 'doorbell' of the receiving process, which waits on it when it cannot make progress.
+class Channel:
+    def __init__(self, capacity, doorbell):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity * RECORD.size)
+        self.messages = multiprocessing.Semaphore(0)
+        self.free_slots = multiprocessing.Semaphore(capacity)
+        self.doorbell = doorbell
+        self.routes = [] # route id -> (target statechart name, input event, delay)
+        self.position = 0 # sender and receiver (in different processes) each have their own copy
+
+    # on_full is called while waiting for a free slot (the receiver may be waiting for us, too)
+    def send(self, kind, timestamp, route_id=0, value=None, on_full=None):
+        while not self.free_slots.acquire(block=False):
+            if on_full is not None:
+                on_full()
+            if self.free_slots.acquire(timeout=0.001):
+                break
+        offset = (self.position % self.capacity) * RECORD.size
+        if value is None:
+            RECORD.pack_into(self.shm.buf, offset, kind, NONE, route_id, timestamp, 0)
+        elif value is True or value is False:
+            RECORD.pack_into(self.shm.buf, offset, kind, BOOL, route_id, timestamp, value)
+        elif isinstance(value, int):
+            RECORD.pack_into(self.shm.buf, offset, kind, INT, route_id, timestamp, value) # raises struct.error if it does not fit in 64 bits
+        elif isinstance(value, float):
+            RECORD.pack_into(self.shm.buf, offset, kind, FLOAT, route_id, timestamp, 0)
+            FLOAT_VALUE.pack_into(self.shm.buf, offset + FLOAT_VALUE_OFFSET, value)
+        else:
+            raise ValueError(f"cannot send value of type {type(value).__name__} to another process: {value!r}")
+        self.position += 1
+        self.messages.release()
+        self.doorbell.release()
+
+    # Returns (kind, timestamp, route_id, value), or None if there is no message
+    def receive(self):
+        if not self.messages.acquire(block=False):
+            return None
+        offset = (self.position % self.capacity) * RECORD.size
+        kind, value_type, route_id, timestamp, value = RECORD.unpack_from(self.shm.buf, offset)
+        if value_type == NONE:
+            value = None
+        elif value_type == BOOL:
+            value = bool(value)
+        elif value_type == FLOAT:
+            value = FLOAT_VALUE.unpack_from(self.shm.buf, offset + FLOAT_VALUE_OFFSET)[0]
+        self.position += 1
+        self.free_slots.release()
+        return (kind, timestamp, route_id, value)
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
+# The receiving end of a Channel, in the receiving process
+class InputChannel:
+    def __init__(self, channel, statecharts):
+        self.channel = channel
+        self.routes = [(get_raise_method(statecharts[target], input_event), input_event, statecharts[target], delay) for (target, input_event, delay) in channel.routes]
+        self.min_delay = min(delay for (_, _, _, delay) in self.routes)
+        self.buffered = [] # received events that are not in the event queue yet: (creation time, route id, value)-tuples
+        self.first_buffered = 0 # index in 'buffered'
+        self.promise = 0
+
+    # Lowest creation time of the events that have not been put in the event queue yet, or will still be received
+    def horizon(self):
+        if self.first_buffered < len(self.buffered):
+            return self.buffered[self.first_buffered][0]
+        return self.promise
+
+    def poll(self, process_name):
+        while True:
+            message = self.channel.receive()
+            if message is None:
+                return
+            kind, timestamp, route_id, value = message
+            if timestamp < self.promise:
+                raise RuntimeError(f"Process '{process_name}' received an event created at {timestamp}, after a promise of {self.promise}: the lookahead of the sender is too large")
+            self.promise = timestamp
+            if kind == EVENT:
+                self.buffered.append((timestamp, route_id, value))
+
+    # Puts the buffered events that were created at or before 'until' in the event queue
+    def release(self, controller, until):
+        buffered = self.buffered
+        i = self.first_buffered
+        while i < len(buffered) and buffered[i][0] <= until:
+            creation_time, route_id, value = buffered[i]
+            raise_method, input_event, sc, delay = self.routes[route_id]
+            controller.add_input_lowlevel(creation_time + delay, raise_method, value, input_event, sc)
+            i += 1
+        if i == len(buffered):
+            buffered.clear()
+            i = 0
+        self.first_buffered = i
+
+# Sends an output event of a statechart to another process
+class ChannelRoute(Observer):
+    def __init__(self, lp, channel, route_id, transform):
+        self.lp = lp
+        self.channel = channel
+        self.route_id = route_id
+        self.transform = transform
+
+    def next(self, value=None):
+        if self.transform is not None:
+            value = self.transform(value)
+        self.channel.send(EVENT, self.lp.controller.simulated_time, self.route_id, value, on_full=self.lp.poll)
+
+# One process of a CoSimulation, as it runs in its OS process
+class LogicalProcess:
+    def __init__(self, spec):
+        self.name = spec.name
+        self.spec = spec
+        self.lookahead = spec.lookahead
+        self.doorbell = multiprocessing.Semaphore(0)
+        self.input_channels = [] # Channel
+        self.output_channels = [] # Channel
+        self.routes = [] # (source statechart name, output event, channel, route id, transform)-tuples
+
+    def run(self, until, connection):
+        try:
+            connection.send((True, self.simulate(until)))
+        except:
+            connection.send((False, traceback.format_exc()))
+        connection.close()
+
+    def poll(self):
+        for input_channel in self.inputs:
+            input_channel.poll(self.name)
+
+    def send_promise(self, promise):
+        for channel in self.output_channels:
+            channel.send(PROMISE, promise, on_full=self.poll)
+
+    def simulate(self, until):
+        controller = self.controller = Controller()
+        statecharts = self.spec.build_statecharts(controller)
+        tracers = trace_statecharts(controller, statecharts)
+        if self.routes or self.input_channels:
+            # the loop below runs until 'limit - 1' to handle everything before 'limit', which only works with integer timestamps (e.g., not with timers of a fractional number of nanoseconds)
+            def check_event_timestamp(timestamp, event_name, value):
+                check_timestamp(timestamp, f"Timestamp of event '{event_name}'")
+            for sc in statecharts.values():
+                controller.register_input_tracer(sc, check_event_timestamp)
+        for source, output_event, channel, route_id, transform in self.routes:
+            get_observable(statecharts[source], output_event).subscribe(ChannelRoute(self, channel, route_id, transform))
+        self.inputs = [InputChannel(channel, statecharts) for channel in self.input_channels]
+        for sc in statecharts.values():
+            sc.enter()
+
+        last_promise = -1
+        while True:
+            self.poll()
+            # no event created before 'horizon' can still be received
+            horizon = min((input_channel.horizon() for input_channel in self.inputs), default=math.inf)
+            limit = min(horizon, until)
+            # Received events are put in the event queue only once everything before their creation time has happened, so that they occur after the events that were created earlier (like they would in a single process).
+            controller.run_until(limit - 1)
+            for input_channel in self.inputs:
+                input_channel.release(controller, limit)
+            controller.run_until(limit)
+            # Our statecharts can only raise output events for our own events, or for received events (after 'lookahead')
+            earliest = controller.get_earliest() if controller.have_event() else math.inf
+            if earliest != math.inf:
+                check_timestamp(earliest, "Timestamp of the next event")
+            promise = min(earliest, min((input_channel.horizon() + input_channel.min_delay for input_channel in self.inputs), default=math.inf) + self.lookahead)
+            if promise > last_promise:
+                last_promise = promise
+                self.send_promise(min(promise, NEVER))
+            if horizon > until:
+                break
+            if min(input_channel.horizon() for input_channel in self.inputs) > horizon:
+                continue # we have released buffered events, and can go further without new messages
+            # wait for messages
+            self.doorbell.acquire()
+            while self.doorbell.acquire(block=False):
+                pass
+        return get_scenarios(tracers)
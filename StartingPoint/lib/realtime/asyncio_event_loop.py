@@ -0,0 +1,99 @@
+import asyncio
+import functools
+
+from lib.controller import Controller
+from lib.realtime.realtime import WallClock
+from lib.realtime.event_loop import AbstractEventLoop, EventLoopRealTimeSimulation
+from lib.yakindu_helpers import trace_output_events
+
+# schedules calls in an asyncio event loop
+class AsyncioEventLoopAdapter(AbstractEventLoop):
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+
+    def schedule(self, delay, callback):
+        return self.loop.call_later(delay / 1000000000, # ns to s
+            callback)
+
+    def cancel(self, timer):
+        timer.cancel()
+
+# Runs a simulation in real-time, in an asyncio event loop, without a thread of its own, so many simulations can share the same event loop.
+# Input events can be raised, and output events can be awaited, from coroutines running in the same event loop.
+#
+# Typical usage (from a coroutine):
+#   sim = AsyncioRealTimeSimulation(controller, wall_clock)
+#   wall_clock.record_start_time()
+#   sc.enter()
+#   sim.poke()
+#   simtime, value = await sim.inject(sc, "request_lvl_change", expect="set_request_pending")
+#
+# Everything happens in the event loop's thread, so the statecharts' event queues don't need locking (see lib.yakindu_helpers.use_event_deques).
+class AsyncioRealTimeSimulation(EventLoopRealTimeSimulation):
+    def __init__(self, controller: Controller, wall_clock: WallClock, loop=None, termination_condition=lambda: False, time_advance_callback=lambda simtime:None, stats=None):
+        event_loop = AsyncioEventLoopAdapter(loop)
+        super().__init__(controller, event_loop, wall_clock, termination_condition, time_advance_callback, stats)
+        self.loop = event_loop.loop
+        self.listeners = {} # statechart -> list of callbacks (simtime, event_name, value) -> bool, returning True when they no longer want to be called
+
+    def on_output_event(self, sc, simtime, event_name, value):
+        listeners = self.listeners[sc]
+        for listener in list(listeners): # listeners may add listeners
+            if listener(simtime, event_name, value):
+                listeners.remove(listener)
+
+    def add_listener(self, sc, listener):
+        if sc not in self.listeners:
+            self.listeners[sc] = []
+            trace_output_events(self.controller, sc, callback=functools.partial(self.on_output_event, sc))
+        self.listeners[sc].append(listener)
+
+    # Returns a future for the next output event 'event_name' of 'sc' (for which predicate(value) holds, if a predicate is given), with (simtime, value) as its result.
+    # Only output events that occur after this call are considered.
+    def expect_output(self, sc, event_name, predicate=None):
+        future = self.loop.create_future()
+        def listener(simtime, name, value):
+            if future.done():
+                return True # e.g., canceled because of a timeout
+            if name == event_name and (predicate is None or predicate(value)):
+                future.set_result((simtime, value))
+                return True
+            return False
+        self.add_listener(sc, listener)
+        return future
+
+    async def wait_for_output(self, sc, event_name, predicate=None):
+        return await self.expect_output(sc, event_name, predicate)
+
+    # Raises an input event at the current (wall-clock) time, and handles it right away.
+    # If 'expect' is given, also waits for that output event (which is expected before the input is raised, so it cannot be missed), and returns its (simtime, value).
+    async def inject(self, sc, event, value=None, expect=None, predicate=None):
+        future = self.expect_output(sc, expect, predicate) if expect is not None else None
+        self.add_input_now(sc, event, value)
+        if future is not None:
+            return await future
+
+    # Returns an async iterator over all output events of 'sc' from now on, as (simtime, event_name, value)-tuples
+    def output_events(self, sc):
+        queue = asyncio.Queue()
+        closed = False
+        def listener(simtime, event_name, value):
+            if closed:
+                return True
+            queue.put_nowait((simtime, event_name, value))
+            return False
+        self.add_listener(sc, listener)
+        async def iterate():
+            nonlocal closed
+            try:
+                while True:
+                    yield await queue.get()
+            finally:
+                closed = True
+        return iterate()
+
+    # Cancels the next wakeup of the simulation (it will be woken up again by the next input event, if any)
+    def stop(self):
+        if self.scheduled_id is not None:
+            self.event_loop.cancel(self.scheduled_id)
+            self.scheduled_id = None
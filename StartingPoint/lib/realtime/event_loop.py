@@ -19,7 +19,7 @@ class AbstractEventLoop:
 # Depending on how fast your computer is, simulated time will always run a tiny bit behind wall-clock time, but this error will NOT grow over time.
 class EventLoopRealTimeSimulation(AbstractRealTimeSimulation):
 
-    def __init__(self, controller: Controller, event_loop: AbstractEventLoop, wall_clock: WallClock, termination_condition=lambda: False, time_advance_callback=lambda simtime:None):
+    def __init__(self, controller: Controller, event_loop: AbstractEventLoop, wall_clock: WallClock, termination_condition=lambda: False, time_advance_callback=lambda simtime:None, stats=None):
         self.controller = controller
         self.event_loop = event_loop
 
@@ -34,12 +34,33 @@ class EventLoopRealTimeSimulation(AbstractRealTimeSimulation):
         # At most one timer will be scheduled at the same time
         self.scheduled_id = None
 
-    def poke(self):
+        # Optional lib.realtime.instrumentation.RealTimeStats, to measure how well the simulation keeps up with the wall clock
+        self.stats = stats
+        self.intended_wakeup = None # wall-clock time (perf_counter_ns) for which the next wakeup is scheduled
+        self.scheduled_timestamp = None # simulated time of the earliest event, for which the next wakeup is scheduled
+
+    # called by the event loop, when the scheduled time has come
+    def wakeup(self):
+        self.poke(woken_up=True)
+
+    def poke(self, woken_up=False):
         if self.scheduled_id is not None:
             self.event_loop.cancel(self.scheduled_id)
 
+        if self.stats is not None:
+            start = time.perf_counter_ns()
+            if woken_up:
+                self.stats.record_wakeup(start - self.intended_wakeup)
+
         self.controller.run_until(self.wall_clock.time_since_start()) # this call may actually consume some time
 
+        if self.stats is not None:
+            lag = None
+            if woken_up:
+                # undo the slowdown of the wall clock, so that overruns are included in the lag
+                lag = self.wall_clock.time_since_start() - self.wall_clock.purposefully_behind - self.scheduled_timestamp
+            self.stats.record_run(time.perf_counter_ns() - start, lag)
+
         self.time_advance_callback(self.controller.simulated_time)
 
         if self.termination_condition():
@@ -48,8 +69,12 @@ class EventLoopRealTimeSimulation(AbstractRealTimeSimulation):
 
         if self.controller.have_event():
             # schedule next wakeup
-            sleep_duration = self.wall_clock.sleep_duration_until(self.controller.get_earliest())
-            self.scheduled_id = self.event_loop.schedule(sleep_duration, self.poke)
+            earliest_event_time = self.controller.get_earliest()
+            sleep_duration = self.wall_clock.sleep_duration_until(earliest_event_time)
+            if self.stats is not None:
+                self.intended_wakeup = time.perf_counter_ns() + sleep_duration
+                self.scheduled_timestamp = earliest_event_time
+            self.scheduled_id = self.event_loop.schedule(sleep_duration, self.wakeup)
             # print("sleeping for", pretty_time(sleep_duration))
         else:
             # print("sleeping until woken up")
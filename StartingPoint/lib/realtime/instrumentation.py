@@ -0,0 +1,101 @@
+import time
+
+# Histogram of integers (e.g., durations in nanoseconds), with a bounded relative error, and constant memory no matter how many values are recorded.
+# Values are counted in buckets that are exact for small values (below 2^precision_bits), and 2^(precision_bits-1) buckets per power of two above that, so percentiles are off by at most 1/2^(precision_bits-1) (~1.6% by default).
+class Histogram:
+    def __init__(self, precision_bits=7):
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << (precision_bits - 1)
+        self.counts = {} # bucket index -> count (negative indices for negative values)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = int(value)
+        if value >= 0:
+            index = self.bucket_index(value)
+        else:
+            index = -1 - self.bucket_index(-value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def bucket_index(self, value):
+        shift = max(value.bit_length() - self.precision_bits, 0)
+        return shift * self.sub_buckets + (value >> shift)
+
+    # Largest (absolute) value that falls into the bucket
+    def bucket_limit(self, index):
+        if index < 0:
+            return -self.bucket_lower_limit(-1 - index)
+        shift = max(index // self.sub_buckets - 1, 0)
+        return ((index - shift * self.sub_buckets + 1) << shift) - 1
+
+    def bucket_lower_limit(self, index):
+        shift = max(index // self.sub_buckets - 1, 0)
+        return (index - shift * self.sub_buckets) << shift
+
+    # The value below which (at least) p percent of the recorded values fall (p between 0 and 100), or None if nothing was recorded
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = max(1, -(-self.count * p // 100)) # ceil
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self.bucket_limit(index), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    # One-line summary, with values divided by 'unit' (e.g., 1000000 for milliseconds)
+    def summary(self, unit=1000000, unit_name="ms"):
+        if self.count == 0:
+            return "no data"
+        def fmt(value):
+            return f"{value / unit:.3f}"
+        percentiles = ", ".join(f"p{p}={fmt(self.percentile(p))}" for p in (50, 90, 99, 99.9))
+        return f"n={self.count}, min={fmt(self.min)}, {percentiles}, max={fmt(self.max)}, mean={fmt(self.mean())} ({unit_name})"
+
+# Measurements of a real-time simulation (EventLoopRealTimeSimulation or ThreadedRealTimeSimulation), to see whether (and by how much) it keeps up with the wall clock, e.g., to choose a time_scale for a given machine:
+#   wakeup_latency: for every wakeup that was scheduled for the next event, how much later than intended it happened (wall-clock ns; negative if early)
+#   run_duration:   for every wakeup, the time spent in Controller.run_until (wall-clock ns)
+#   lag:            for every scheduled wakeup, how far behind the (scaled) wall clock the simulation was when it was done handling the events that were due (simulated ns), including the overruns that WallClock.sleep_duration_until absorbs
+# If dump_interval (wall-clock seconds) is given, dump(report) is called at most that often, while the simulation runs.
+class RealTimeStats:
+    def __init__(self, dump_interval=None, dump=print):
+        self.wakeup_latency = Histogram()
+        self.run_duration = Histogram()
+        self.lag = Histogram()
+        self.dump_interval = dump_interval
+        self.dump = dump
+        self.last_dump = time.perf_counter_ns()
+
+    def record_wakeup(self, latency):
+        self.wakeup_latency.record(latency)
+
+    def record_run(self, duration, lag=None):
+        self.run_duration.record(duration)
+        if lag is not None:
+            self.lag.record(lag)
+        if self.dump_interval is not None:
+            now = time.perf_counter_ns()
+            if now - self.last_dump >= self.dump_interval * 1000000000:
+                self.last_dump = now
+                self.dump(self.report())
+
+    def report(self):
+        return "\n".join([
+            "Real-time simulation statistics:",
+            f"  wakeup latency (wall-clock): {self.wakeup_latency.summary()}",
+            f"  run_until duration (wall-clock): {self.run_duration.summary()}",
+            f"  lag (simulated time): {self.lag.summary()}",
+        ])
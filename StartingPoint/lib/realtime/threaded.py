@@ -1,43 +1,151 @@
+import collections
+import heapq
 import threading
+import time
 
 from lib.realtime.realtime import WallClock, AbstractRealTimeSimulation
-from lib.controller import Controller, pretty_time
+from lib.controller import Controller, get_raise_method, pretty_time
 
-# Runs simulation, real-time, in its own thread
+# Runs one or more real-time simulations in a thread of their own.
+# Every simulation has its own Controller (and WallClock), but they all sleep until the earliest wakeup of any of them, or until an input event arrives.
+#
+# Typical usage (many simulations in one thread):
+#   worker = RealTimeWorker()
+#   sims = [ThreadedRealTimeSimulation(controller, wall_clock, worker=worker) for (controller, wall_clock) in ...]
+#   thread = threading.Thread(target=worker.mainloop)
+#   thread.start()
+class RealTimeWorker:
+    def __init__(self):
+        self.simulations = set() # that have not terminated yet
+        self.deadlines = [] # heap of (wall-clock time (perf_counter_ns), sequence number, simulation); outdated entries are skipped
+        self.next_sequence_number = 0
+        self.ready = collections.deque() # simulations that have received input events (appended to by any thread)
+        self.wakeup_event = threading.Event()
+        self.stop_requested = False
+
+    def add(self, simulation):
+        self.simulations.add(simulation)
+        self.ready.append(simulation) # run it (at least) once, when the mainloop starts
+        self.wakeup_event.set()
+
+    # Can be called from any thread
+    def wake(self, simulation):
+        self.ready.append(simulation)
+        self.wakeup_event.set()
+
+    # Can be called from any thread. Makes mainloop return as soon as possible.
+    def stop(self):
+        self.stop_requested = True
+        self.wakeup_event.set()
+
+    def step(self, simulation, woken_up):
+        if simulation not in self.simulations:
+            return # terminated
+        deadline = simulation.step(woken_up)
+        if simulation.terminated:
+            self.simulations.discard(simulation)
+        elif deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, self.next_sequence_number, simulation))
+            self.next_sequence_number += 1
+
+    # Returns when all simulations have terminated, or when stop() was called
+    def mainloop(self):
+        ready = self.ready
+        deadlines = self.deadlines
+        while not self.stop_requested:
+            # Clear before looking for work: a 'wake' that happens after this point will interrupt the wait below.
+            self.wakeup_event.clear()
+            for _ in range(len(ready)): # not 'while ready', so that busy producers cannot starve the other simulations
+                self.step(ready.popleft(), woken_up=False)
+            now = time.perf_counter_ns() # not re-read in the loop, so that simulations that cannot keep up cannot starve the rest of the mainloop
+            while deadlines and deadlines[0][0] <= now:
+                deadline, _, simulation = heapq.heappop(deadlines)
+                if deadline == simulation.deadline: # otherwise, it was rescheduled in the meantime
+                    self.step(simulation, woken_up=True)
+            if not self.simulations:
+                break
+            if ready:
+                continue
+            if deadlines:
+                timeout = (deadlines[0][0] - time.perf_counter_ns()) / 1000000000
+                if timeout > 0:
+                    # print('thread sleeping for', pretty_time(timeout * 1000000000), 'or until interrupted')
+                    self.wakeup_event.wait(timeout)
+            else:
+                # print('thread sleeping until interrupted')
+                self.wakeup_event.wait()
+        self.stop_requested = False
+
+# Runs a simulation in real-time, in a thread of its own (or in a RealTimeWorker's thread that it shares with other simulations)
 #
 # Typical usage:
 #   thread = threading.Thread(
 #      target=ThreadedRealTimeSimulation(...).mainloop,
 #   )
 #   thread.start()
+#
+# add_input_now can be called from any thread: input events are put in an injection buffer (a collections.deque, of which 'append' and 'popleft' are atomic, so no lock is taken), and moved into the Controller's event queue by the simulation's thread, which is the only thread that touches the Controller and the statecharts.
+# Therefore, the statecharts' event queues don't need locking (see lib.yakindu_helpers.use_event_deques).
 class ThreadedRealTimeSimulation(AbstractRealTimeSimulation):
-    def __init__(self, controller: Controller, wall_clock: WallClock, termination_condition = lambda: False):
+    def __init__(self, controller: Controller, wall_clock: WallClock, termination_condition = lambda: False, stats=None, worker=None):
         self.controller = controller
         self.wall_clock = wall_clock
         self.termination_condition = termination_condition
-        self.condition = threading.Condition()
+        # Optional lib.realtime.instrumentation.RealTimeStats, to measure how well the simulation keeps up with the wall clock
+        self.stats = stats
+        self.inputs = collections.deque() # injection buffer of (timestamp, raise_method, value, event_name, sc)-tuples
+        self.last_input_timestamp = 0
+        self.terminated = False
+        self.deadline = None # wall-clock time (perf_counter_ns) of the next wakeup
+        self.scheduled_timestamp = None # simulated time of the earliest event, for which the next wakeup is scheduled
+        self.worker = worker if worker is not None else RealTimeWorker()
+        self.worker.add(self)
 
+    # Runs the simulation (and all other simulations of the same worker) in the calling thread
     def mainloop(self):
-        while True:
-            self.controller.run_until(self.wall_clock.time_since_start())
-            if self.termination_condition():
-                print("Termination condition satisfied. Stop mainloop.")
-                return
-            if self.controller.have_event():
-                earliest_event_time = self.controller.get_earliest()
-                sleep_duration = self.wall_clock.sleep_duration_until(earliest_event_time)
-                with self.condition:
-                    # print('thread sleeping for', pretty_time(sleep_duration), 'or until interrupted')
-                    self.condition.wait(sleep_duration / 1000000000)
-                    # print('thread woke up')
-            else:
-                with self.condition:
-                    # print('thread sleeping until interrupted')
-                    self.condition.wait()
+        self.worker.mainloop()
+
+    # Moves the injected input events into the event queue
+    def drain_inputs(self):
+        inputs = self.inputs
+        controller = self.controller
+        while inputs:
+            timestamp, raise_method, value, event_name, sc = inputs.popleft()
+            # The simulation may have advanced past the time at which the event was raised, before we got to it. It cannot go back in time.
+            # Also, the wall clock can go back a bit (see WallClock.sleep_duration_until), but injected events must occur in the order in which they were injected.
+            timestamp = max(timestamp, controller.simulated_time, self.last_input_timestamp)
+            self.last_input_timestamp = timestamp
+            controller.add_input_lowlevel(timestamp, raise_method, value, event_name, sc)
+
+    # Called by the worker thread. Returns the wall-clock time (perf_counter_ns) of the next wakeup, or None if there are no more events.
+    def step(self, woken_up=False):
+        if self.stats is not None:
+            start = time.perf_counter_ns()
+            if woken_up:
+                self.stats.record_wakeup(start - self.deadline)
+        self.drain_inputs()
+        self.controller.run_until(self.wall_clock.time_since_start()) # this call may actually consume some time
+        if self.stats is not None:
+            lag = None
+            if woken_up:
+                # undo the slowdown of the wall clock, so that overruns are included in the lag
+                lag = self.wall_clock.time_since_start() - self.wall_clock.purposefully_behind - self.scheduled_timestamp
+            self.stats.record_run(time.perf_counter_ns() - start, lag)
+        if self.termination_condition():
+            print("Termination condition satisfied. Stop mainloop.")
+            self.terminated = True
+            self.deadline = None
+        elif self.controller.have_event():
+            earliest_event_time = self.controller.get_earliest()
+            sleep_duration = self.wall_clock.sleep_duration_until(earliest_event_time)
+            self.scheduled_timestamp = earliest_event_time
+            self.deadline = time.perf_counter_ns() + sleep_duration
+        else:
+            self.deadline = None
+        return self.deadline
 
+    # Can be called from any thread
     def add_input_now(self, sc, event, value=None):
-        with self.condition:
-            self.controller.add_input(sc, event,
-                timestamp=self.wall_clock.time_since_start(),
-                value=value)
-            self.condition.notify()
+        raise_method = get_raise_method(sc, event) # fails in the calling thread, rather than in the simulation's thread
+        self.inputs.append((self.wall_clock.time_since_start(), raise_method, value, event, sc))
+        self.worker.wake(self)
@@ -1,9 +1,15 @@
 import abc
-from difflib import ndiff
+import contextlib
+import dataclasses
+import functools
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 from lib.controller import Controller, pretty_time
+from lib.diff import diff, window
 from lib.tracer import Tracer
-from lib.yakindu_helpers import YakinduTimerServiceAdapter, trace_output_events
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, trace_output_events, use_event_deques
 
 class AbstractEnvironmentState:
     # should return the new state after handling the event
@@ -15,6 +21,61 @@ class AbstractEnvironmentState:
     def __eq__(self, other):
         pass
 
+# Alternative to AbstractEnvironmentState, that does not create a new state object for every event, and does not need to compare states.
+# The state is updated in-place, and the environment itself tells whether the event had an effect.
+# lib.test accepts environment classes of either kind.
+class AbstractCompactEnvironmentState:
+    # should update the state, and return whether the event had an effect (i.e., whether the state changed)
+    @abc.abstractmethod
+    def apply_event(self, event_name, param):
+        pass
+
+# Returns a compact environment class that behaves exactly like the given AbstractEnvironmentState class, with its state packed into a single integer.
+# The distinct states are numbered in the order in which they are reached, and the effect of an event on a state is only computed once (with handle_event), after which it is a dict lookup.
+# Only worth it for environments with few distinct states (e.g., the plant of runner_tests.py), and event parameters must be hashable.
+def packed_environment_class(environment_class):
+    states = [environment_class()] # state number -> state
+    transitions = {} # (state number, event_name, param) -> state number
+
+    class PackedEnvironmentState(AbstractCompactEnvironmentState):
+        __slots__ = ('state',)
+
+        def __init__(self):
+            self.state = 0
+
+        def apply_event(self, event_name, param):
+            key = (self.state, event_name, param)
+            try:
+                new_state = transitions[key]
+            except KeyError:
+                new_env_state = states[self.state].handle_event(event_name, param)
+                # states are only compared by value:
+                new_state = next((i for i, env_state in enumerate(states) if env_state == new_env_state), len(states))
+                if new_state == len(states):
+                    states.append(new_env_state)
+                transitions[key] = new_state
+            if new_state == self.state:
+                return False
+            self.state = new_state
+            return True
+
+    PackedEnvironmentState.__name__ = 'Packed' + environment_class.__name__
+    return PackedEnvironmentState
+
+# Returns a function (event_name, param) -> bool that tells whether an event has an effect on the environment, given all the events it has been called with before.
+def make_effect_filter(environment_class):
+    env_state = environment_class()
+    if isinstance(env_state, AbstractCompactEnvironmentState):
+        return env_state.apply_event
+    # AbstractEnvironmentState:
+    def has_effect(event_name, param):
+        nonlocal env_state
+        new_env_state = env_state.handle_event(event_name, param)
+        changed = new_env_state != env_state
+        env_state = new_env_state
+        return changed
+    return has_effect
+
 # # Can we ignore event in 'trace' at position 'idx' with respect to idempotency?
 # def can_ignore(trace, idx):
 #     (timestamp, event_name, value) = trace[idx]
@@ -39,16 +100,15 @@ class AbstractEnvironmentState:
 #     return False
 
 def postprocess_trace(trace, environment_class):
-    env_state = environment_class()
-    filtered_trace = []
+    return list(iter_postprocessed_trace(trace, environment_class))
+
+# Same as postprocess_trace, but lazily
+def iter_postprocessed_trace(trace, environment_class):
+    has_effect = make_effect_filter(environment_class)
     # Remove events that have no effect:
     for timestamp, event_name, param in trace:
-        new_env_state = env_state.handle_event(event_name, param)
-        if new_env_state != env_state:
-            # event had an effect
-            filtered_trace.append((timestamp, event_name, param))
-        env_state = new_env_state
-    return filtered_trace
+        if has_effect(event_name, param):
+            yield (timestamp, event_name, param)
 
 def compare_traces(expected, actual):
     i = 0
@@ -68,18 +128,60 @@ def compare_traces(expected, actual):
     print("Traces match.")
     return True
 
-def run_scenario(input_trace, expected_output_trace, statechart_class, environment_class, verbose=False):
+# Compares the output events of a running simulation with an expected output trace, while the simulation runs, and stops the Controller at the first difference that can no longer be undone.
+# Output events are filtered in the same way as postprocess_trace does, one at a time: whether an event has an effect only depends on the events before it, so the filtered traces are compared as they grow.
+# As a consequence, run_scenario with stop_at_divergence=True passes and fails exactly the same scenarios as without it.
+class StreamingTraceComparator:
+    def __init__(self, controller, expected_output_trace, environment_class):
+        self.controller = controller
+        self.clean_expected = iter_postprocessed_trace(expected_output_trace, environment_class)
+        self.next_expected = next(self.clean_expected, None) # next event of the (filtered) expected trace, None if there are no more
+        self.has_effect = make_effect_filter(environment_class)
+        self.divergence_timestamp = None # earliest timestamp at which the traces differ, once a difference has been found
+
+    def diverge(self, timestamp):
+        self.divergence_timestamp = timestamp
+        self.controller.stop()
+
+    def record_output_event(self, simtime, event_name, value):
+        if self.divergence_timestamp is not None:
+            return
+        if self.has_effect(event_name, value):
+            if self.next_expected is None:
+                self.diverge(simtime) # event was not expected
+            elif self.next_expected != (simtime, event_name, value):
+                self.diverge(min(simtime, self.next_expected[0]))
+            else:
+                self.next_expected = next(self.clean_expected, None)
+
+    # To be registered as an input tracer: if an event occurs later than the next expected output event, that output event did not happen in time
+    def record_input_event(self, simtime, event_name, value):
+        if self.divergence_timestamp is None and self.next_expected is not None and simtime > self.next_expected[0]:
+            self.diverge(self.next_expected[0])
+
+    # To be called when the simulation has ended: the expected output events that did not happen (if any) are a difference, too
+    def finish(self):
+        if self.divergence_timestamp is None and self.next_expected is not None:
+            self.divergence_timestamp = self.next_expected[0]
+
+# stop_at_divergence: if True, the simulation is stopped at the first difference with the expected output trace, and only the traces up to that point are compared (and printed)
+# event_deques: if True, the statechart's event queues are replaced by (faster, but not thread-safe) EventDeques, see lib.yakindu_helpers.use_event_deques
+def run_scenario(input_trace, expected_output_trace, statechart_class, environment_class, verbose=False, max_divergences=None, stop_at_divergence=False, event_deques=False):
     controller = Controller()
     sc = statechart_class()
+    if event_deques:
+        use_event_deques(sc)
     tracer = Tracer(verbose=False)
-    controller.input_tracers.append((sc, tracer.record_input_event))
+    controller.register_input_tracer(sc, tracer.record_input_event)
     trace_output_events(controller, sc, callback=tracer.record_output_event)
+    if stop_at_divergence:
+        comparator = StreamingTraceComparator(controller, expected_output_trace, environment_class)
+        controller.register_input_tracer(sc, comparator.record_input_event)
+        trace_output_events(controller, sc, callback=comparator.record_output_event)
     sc.timer_service = YakinduTimerServiceAdapter(controller)
 
     # Put entire input trace in event queue, ready to go!
-    for tup in input_trace:
-        (timestamp, event_name, value) = tup
-        controller.add_input(sc, event_name, timestamp, value)
+    controller.add_inputs(sc, input_trace)
 
     sc.enter() # enter default state(s)
     
@@ -91,8 +193,21 @@ def run_scenario(input_trace, expected_output_trace, statechart_class, environme
     # Blocking synchronous call:
     controller.run_until(last_output_event_timestamp)
 
-    actual_output_trace = tracer.output_events
+    if stop_at_divergence:
+        if comparator.divergence_timestamp is not None:
+            print(f"Traces differ at time {pretty_time(comparator.divergence_timestamp)}, simulation stopped at time {pretty_time(controller.simulated_time)}.")
+            # only compare (and print) the traces up to where the simulation stopped:
+            expected_output_trace = [event for event in expected_output_trace if event[0] <= controller.simulated_time]
+        else:
+            comparator.finish()
+            if comparator.divergence_timestamp is not None:
+                print(f"Traces differ at time {pretty_time(comparator.divergence_timestamp)}.")
 
+    return check_output_trace(expected_output_trace, tracer.output_events, environment_class, verbose, max_divergences)
+
+# Compares an actual output trace with the expected one (ignoring events that have no effect on the environment), and prints a diff if they differ
+# max_divergences: if not None, the diff only shows the first max_divergences blocks of differences, with some context around them
+def check_output_trace(expected_output_trace, actual_output_trace, environment_class, verbose=False, max_divergences=None):
     clean_expected = postprocess_trace(expected_output_trace, environment_class)
     clean_actual   = postprocess_trace(actual_output_trace, environment_class)
 
@@ -102,23 +217,26 @@ def run_scenario(input_trace, expected_output_trace, statechart_class, environme
         have_plus = False
         have_minus = False
         have_useless = False
-        for diffline in ndiff(
-                [str(tup)+'\n' for tup in expected_output_trace],
-                [str(tup)+'\n' for tup in actual_output_trace],
-                charjunk=None,
-            ):
-            symbol = diffline[0]
+        clean_expected_lines = set(str(tup) for tup in clean_expected)
+        clean_actual_lines = set(str(tup) for tup in clean_actual)
+        ops = diff(
+            [str(tup) for tup in expected_output_trace],
+            [str(tup) for tup in actual_output_trace])
+        if max_divergences is not None:
+            ops = window(ops, max_divergences)
+        for op in ops:
+            if op is None:
+                print("     ...")
+                continue
+            symbol, rest = op
             if symbol == '+':
                 have_plus = True
             if symbol == '-':
                 have_minus = True
-            if symbol == '?':
-                continue
-            rest = diffline[2:-1] # drop last character (=newline)
             useless_line = (
-                   symbol == '-' and rest not in [str(tup) for tup in clean_expected]
-                or symbol == '+' and rest not in [str(tup) for tup in clean_actual]
-                # or symbol == ' ' and rest not in [str(tup) for tup in clean_actual]
+                   symbol == '-' and rest not in clean_expected_lines
+                or symbol == '+' and rest not in clean_actual_lines
+                # or symbol == ' ' and rest not in clean_actual_lines
             )
             if useless_line:
                 print(" (%s) %s" % (symbol, rest))
@@ -145,13 +263,61 @@ def run_scenario(input_trace, expected_output_trace, statechart_class, environme
         print_diff()
     return True
 
-def run_scenarios(scenarios, statechart_class, environment_class, verbose=True):
-    ok = True
-    for scenario in scenarios:
-        print(f"Running scenario: {scenario["name"]}")
-        ok = run_scenario(scenario["input_events"], scenario["output_events"], statechart_class, environment_class, verbose=verbose) and ok
-        print("--------")
-    if ok:
+@dataclasses.dataclass
+class ScenarioResult:
+    name: str
+    ok: bool
+    output: str # everything that was printed while running the scenario
+    wall_time: float # seconds
+
+def run_scenario_captured(scenario, statechart_class, environment_class, verbose, max_divergences, stop_at_divergence, event_deques):
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        ok = run_scenario(scenario["input_events"], scenario["output_events"], statechart_class, environment_class, verbose=verbose, max_divergences=max_divergences, stop_at_divergence=stop_at_divergence, event_deques=event_deques)
+    return ScenarioResult(scenario["name"], ok, output.getvalue(), time.perf_counter() - start)
+
+# Runs all scenarios, and returns a ScenarioResult for every scenario, in the same order.
+# num_workers: None or 1 to run the scenarios one by one in this process, or the number of worker processes to run them in parallel (0: one per CPU core).
+# Either way, the output of every scenario is captured, and printed as a whole, in the order of the scenarios.
+# To run in worker processes, statechart_class and environment_class must be picklable, i.e., defined at the top level of a module (the generated classes are, the classes returned by load_ysc are not).
+def run_scenarios(scenarios, statechart_class, environment_class, verbose=True, num_workers=None, max_divergences=None, stop_at_divergence=False, event_deques=False):
+    run = functools.partial(run_scenario_captured, statechart_class=statechart_class, environment_class=environment_class, verbose=verbose, max_divergences=max_divergences, stop_at_divergence=stop_at_divergence, event_deques=event_deques)
+    start = time.perf_counter()
+    results = []
+    with contextlib.ExitStack() as stack:
+        if num_workers is None or num_workers == 1:
+            result_iterator = map(run, scenarios)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(num_workers or None))
+            result_iterator = executor.map(run, scenarios)
+        for result in result_iterator:
+            print(f"Running scenario: {result.name}")
+            print(result.output, end='')
+            print("--------")
+            results.append(result)
+    wall_time = time.perf_counter() - start
+
+    print("Summary:")
+    for result in results:
+        print(f"  {'passed' if result.ok else 'FAILED'}  {result.wall_time:8.3f} s  {result.name}")
+    print(f"{sum(result.ok for result in results)}/{len(results)} scenarios passed, in {wall_time:.3f} s wall time ({sum(result.wall_time for result in results):.3f} s summed over scenarios)")
+    if all(result.ok for result in results):
         print("All scenarios passed.")
     else:
         print("Some scenarios failed.")
+    return results
+
+# Runs a statechart with an input trace until timestamp 'until', and returns its output trace, e.g., to compare two implementations of the same model.
+# The statechart is set up like run_scenario does, so the output trace is the one that run_scenario would record.
+def record_output_trace(input_trace, until, statechart_class):
+    controller = Controller()
+    sc = statechart_class()
+    tracer = Tracer(verbose=False)
+    controller.register_input_tracer(sc, tracer.record_input_event)
+    trace_output_events(controller, sc, callback=tracer.record_output_event)
+    sc.timer_service = YakinduTimerServiceAdapter(controller)
+    controller.add_inputs(sc, input_trace)
+    sc.enter()
+    controller.run_until(until)
+    return tracer.output_events
@@ -0,0 +1,152 @@
+import heapq
+
+from lib.controller import Controller, QueueEntry
+
+# Hierarchical timing wheel, to be used as an event source of a Controller.
+#
+# Entries can be added and removed in O(1), no matter how many entries are pending. This only pays off if most entries are removed before they are due (see lib.yakindu_helpers.YakinduTimingWheelTimerService).
+# Level 0 has one slot per tick (of 'resolution' nanoseconds), every next level has slots that are 2^slot_bits times as wide.
+# Entries are moved ("released") into the event queue of the Controller shortly before they are due.
+# Because every entry gets its sequence number from the Controller when it is added, the order of events is exactly the same as if the entry had been added to the event queue directly.
+class TimingWheel:
+    def __init__(self, controller: Controller, resolution=1000000, slot_bits=8, num_levels=4):
+        self.controller = controller
+        self.resolution = resolution # nanoseconds per tick
+        self.slot_bits = slot_bits
+        self.slot_mask = (1 << slot_bits) - 1
+        self.num_levels = num_levels
+        # every slot is a dict: QueueEntry -> (timestamp, sequence_number, QueueEntry)
+        self.levels = [[{} for _ in range(1 << slot_bits)] for _ in range(num_levels)]
+        self.overflow = {} # entries that are too far in the future for the top level
+        self.level_counts = [0] * (num_levels + 1) # last element counts the overflow
+        self.num_pending = 0
+        # every entry in the wheel is due at or after this tick:
+        self.tick = int(controller.simulated_time // resolution)
+        controller.add_event_source(self)
+
+    # Same as Controller.add_input_lowlevel, but O(1)
+    # The entry must be canceled with 'remove' (not Controller.cancel), because it is not in the event queue until it is released.
+    def add(self, timestamp, raise_method, value, event_name, sc=None):
+        e = QueueEntry(timestamp, raise_method, value, event_name, sc)
+        controller = self.controller
+        self.place((timestamp, controller.next_sequence_number, e))
+        controller.next_sequence_number += 1
+        return e
+
+    # Same as Controller.cancel, but O(1)
+    def remove(self, e):
+        tick = int(e.timestamp // self.resolution)
+        if tick < self.tick:
+            # already released into the event queue
+            self.controller.cancel(e)
+            return
+        # An entry's slot only depends on its own tick and the current tick, so we don't have to remember where we put it:
+        level, slot = self.locate(tick)
+        if slot.pop(e, None) is not None:
+            self.level_counts[level] -= 1
+            self.num_pending -= 1
+            e.canceled = True
+        else:
+            # not in the wheel, e.g., a periodic entry that was put back into the event queue by the Controller
+            self.controller.cancel(e)
+
+    # Lower bound on the timestamps of the pending entries
+    def horizon(self):
+        return self.tick * self.resolution
+
+    # Advance to the earliest non-empty level 0 slot, and release its entries into the event queue.
+    # Should only be called if there are pending entries.
+    def release_next(self):
+        mask = self.slot_mask
+        while not self.level_counts[0]:
+            self.jump()
+        slots = self.levels[0]
+        index = self.tick & mask
+        while not slots[index]:
+            index += 1
+        slot = slots[index]
+        event_queue = self.controller.event_queue
+        for tup in slot.values():
+            tup[2].queued = True
+        if event_queue:
+            for tup in slot.values():
+                heapq.heappush(event_queue, tup)
+        else:
+            event_queue.extend(sorted(slot.values())) # a sorted list is a valid heap
+        self.level_counts[0] -= len(slot)
+        self.num_pending -= len(slot)
+        slot.clear()
+        self.tick = ((self.tick & ~mask) | index) + 1
+        if self.tick & mask == 0:
+            self.cascade()
+
+    # Level 0 is empty: skip ahead to the earliest non-empty slot of a higher level
+    def jump(self):
+        bits = self.slot_bits
+        level = 1
+        while not self.level_counts[level]:
+            level += 1
+        shift = bits * level
+        if level == self.num_levels:
+            # only the overflow is non-empty: skip to the top level revolution of its earliest entry
+            earliest_tick = min(int(tup[0] // self.resolution) for tup in self.overflow.values())
+            self.tick = max(((self.tick >> shift) + 1) << shift, (earliest_tick >> shift) << shift)
+        else:
+            slots = self.levels[level]
+            index = ((self.tick >> shift) & self.slot_mask) + 1
+            while not slots[index]:
+                index += 1
+            outer_shift = shift + bits
+            self.tick = ((self.tick >> outer_shift) << outer_shift) | (index << shift)
+        self.cascade()
+
+    # The current tick has just entered a new slot in one or more higher levels: move the entries of those slots down
+    def cascade(self):
+        bits = self.slot_bits
+        mask = self.slot_mask
+        level = 1
+        while level <= self.num_levels and (self.tick >> (bits * (level - 1))) & mask == 0:
+            level += 1
+        if level > self.num_levels:
+            self.redistribute(self.num_levels, self.overflow)
+        for level in range(min(level - 1, self.num_levels - 1), 0, -1):
+            self.redistribute(level, self.levels[level][(self.tick >> (bits * level)) & mask])
+
+    def redistribute(self, level, slot):
+        if not slot:
+            return
+        tups = list(slot.values())
+        slot.clear()
+        self.level_counts[level] -= len(tups)
+        self.num_pending -= len(tups)
+        for tup in tups:
+            self.place(tup)
+
+    def place(self, tup):
+        tick = int(tup[0] // self.resolution)
+        if tick < self.tick:
+            # already due - bypass the wheel
+            tup[2].queued = True
+            heapq.heappush(self.controller.event_queue, tup)
+            return
+        bits = self.slot_bits
+        if (tick >> bits) == (self.tick >> bits):
+            # common case, inlined: level 0
+            level, slot = 0, self.levels[0][tick & self.slot_mask]
+        else:
+            level, slot = self.locate(tick)
+        tup[2].queued = False # only in the event queue once released
+        slot[tup[2]] = tup
+        self.level_counts[level] += 1
+        self.num_pending += 1
+
+    # Get the slot where an entry that is due at 'tick' belongs: at the lowest level where it is in the same revolution as the current tick
+    def locate(self, tick):
+        bits = self.slot_bits
+        if (tick >> bits) == (self.tick >> bits):
+            return (0, self.levels[0][tick & self.slot_mask])
+        for level in range(1, self.num_levels):
+            outer_shift = bits * (level + 1)
+            if (tick >> outer_shift) == (self.tick >> outer_shift):
+                return (level, self.levels[level][(tick >> (bits * level)) & self.slot_mask])
+        return (self.num_levels, self.overflow)
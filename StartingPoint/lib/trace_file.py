@@ -0,0 +1,342 @@
+import ast
+import bisect
+import json
+import mmap
+import struct
+import sys
+
+# Compact binary file format for (input and output) event traces, much faster to write and load than Python literals, for long recorded sessions.
+#
+# Layout (little-endian, every part padded to a multiple of 8 bytes):
+#   file header: MAGIC, size of the metadata, metadata (JSON, e.g., the name of the scenario)
+#   blocks of at most 'block_size' events of the same trace (INPUT or OUTPUT), each storing its events column by column:
+#     block header: BLOCK_TAG, trace, number of events, sizes of the names and strings sections
+#     names:      JSON list of event names that did not occur in earlier blocks; event names are numbered in order of first occurrence
+#     strings:    JSON list of string values that did not occur in earlier blocks, numbered in the same way
+#     timestamps: int64 per event
+#     values:     8 bytes per event: int64 for bool, int and string (number) values, float64 for float values
+#     name ids:   uint32 per event
+#     types:      uint8 per event (NONE, BOOL, INT, FLOAT or STR)
+#
+# Because blocks are written as soon as they are full, a TraceWriter can record arbitrarily long traces with bounded memory.
+# A TraceReader memory-maps the file, and decodes events only when they are accessed.
+
+MAGIC = b"SCTRACE1"
+BLOCK_TAG = b"BLCK"
+FILE_HEADER = struct.Struct("<8sI")
+BLOCK_HEADER = struct.Struct("<4sIIII")
+
+# traces
+INPUT = 0
+OUTPUT = 1
+
+# value types
+NONE = 0
+BOOL = 1
+INT = 2
+FLOAT = 3
+STR = 4
+
+VALUE_TYPES = {type(None): NONE, bool: BOOL, int: INT, float: FLOAT, str: STR}
+VALUE_CODES = bytes.maketrans(bytes(range(5)), b"qqqdq") # value type -> struct format character of its value
+
+def padding(size):
+    return bytes(-size % 8)
+
+def encode_list(items):
+    return json.dumps(items).encode('utf-8')
+
+# Columns of the events of one trace that have not been written yet.
+# They are kept as lists, and every column is packed at once when the block is written.
+class BlockBuffer:
+    def __init__(self):
+        self.timestamps = []
+        self.values = [] # int (or bool) or float, or the id of a string value
+        self.name_ids = []
+        self.types = []
+
+# Writes a trace file, event by event. Has the same callbacks as lib.tracer.Tracer, so it can record the events of a running simulation directly.
+class TraceWriter:
+    def __init__(self, path, name="", block_size=65536):
+        self.file = open(path, "wb")
+        self.block_size = block_size
+        self.name_ids = {} # event name -> id
+        self.string_ids = {} # string value -> id
+        self.new_names = [] # not yet written
+        self.new_strings = [] # not yet written
+        self.buffers = [BlockBuffer(), BlockBuffer()] # for INPUT and OUTPUT
+        metadata = json.dumps({"name": name}).encode('utf-8')
+        self.file.write(FILE_HEADER.pack(MAGIC, len(metadata)))
+        self.file.write(padding(FILE_HEADER.size))
+        self.file.write(metadata)
+        self.file.write(padding(len(metadata)))
+
+    def record_input_event(self, simtime, event_name, value):
+        if not event_name.startswith("__timer"):
+            # like Tracer, we don't record timer events
+            self.add_event(INPUT, simtime, event_name, value)
+
+    def record_output_event(self, simtime, event_name, value):
+        self.add_event(OUTPUT, simtime, event_name, value)
+
+    def add_event(self, trace, timestamp, event_name, value):
+        buffer = self.buffers[trace]
+        name_id = self.name_ids.get(event_name)
+        if name_id is None:
+            name_id = self.name_ids[event_name] = len(self.name_ids)
+            self.new_names.append(event_name)
+        value_type = VALUE_TYPES.get(type(value))
+        if value_type is None:
+            value_type = self.value_type_of_subclass(value)
+        if value_type == NONE:
+            value = 0
+        elif value_type == STR:
+            string_id = self.string_ids.get(value)
+            if string_id is None:
+                string_id = self.string_ids[value] = len(self.string_ids)
+                self.new_strings.append(value)
+            value = string_id
+        buffer.timestamps.append(timestamp)
+        buffer.values.append(value)
+        buffer.name_ids.append(name_id)
+        buffer.types.append(value_type)
+        if len(buffer.timestamps) >= self.block_size:
+            self.write_block(trace)
+
+    # e.g., for an IntEnum value
+    def value_type_of_subclass(self, value):
+        for value_class, value_type in VALUE_TYPES.items():
+            if isinstance(value, value_class):
+                return value_type
+        raise ValueError(f"cannot store value of type {type(value).__name__} in a trace file: {value!r}")
+
+    def add_events(self, trace, events):
+        for timestamp, event_name, value in events:
+            self.add_event(trace, timestamp, event_name, value)
+
+    # Raises struct.error if a timestamp or an int value does not fit in 64 bits
+    def write_block(self, trace):
+        buffer = self.buffers[trace]
+        num_events = len(buffer.timestamps)
+        types = bytes(buffer.types)
+        names = encode_list(self.new_names)
+        strings = encode_list(self.new_strings)
+        self.new_names = []
+        self.new_strings = []
+        self.file.write(BLOCK_HEADER.pack(BLOCK_TAG, trace, num_events, len(names), len(strings)))
+        self.file.write(padding(BLOCK_HEADER.size))
+        for data in (
+                names,
+                strings,
+                struct.pack(f"<{num_events}q", *buffer.timestamps),
+                struct.pack("<" + types.translate(VALUE_CODES).decode('ascii'), *buffer.values),
+                struct.pack(f"<{num_events}I", *buffer.name_ids),
+                types):
+            self.file.write(data)
+            self.file.write(padding(len(data)))
+        self.buffers[trace] = BlockBuffer()
+
+    # Writes the remaining events to the file
+    def flush(self):
+        for trace, buffer in enumerate(self.buffers):
+            if buffer.timestamps:
+                self.write_block(trace)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Interprets a (little-endian) part of the file as an array, without copying it if possible
+def column(buffer, typecode):
+    if sys.byteorder == 'little':
+        return buffer.cast(typecode)
+    import array
+    a = array.array(typecode, bytes(buffer))
+    a.byteswap()
+    return a
+
+class Block:
+    def __init__(self, timestamps, int_values, float_values, name_ids, types):
+        self.timestamps = timestamps
+        self.int_values = int_values
+        self.float_values = float_values # same bytes as int_values
+        self.name_ids = name_ids
+        self.types = types
+
+    def release(self):
+        for col in (self.timestamps, self.int_values, self.float_values, self.name_ids, self.types):
+            if isinstance(col, memoryview):
+                col.release()
+
+# The events of one trace in a trace file: a read-only sequence of (timestamp, event_name, value)-tuples
+# Only valid until the TraceReader is closed. After that, accessing the events raises ValueError.
+class TraceView:
+    def __init__(self, reader, blocks):
+        self.reader = reader
+        self.blocks = blocks
+        self.block_starts = [] # index of the first event of every block
+        num_events = 0
+        for block in blocks:
+            self.block_starts.append(num_events)
+            num_events += len(block.timestamps)
+        self.num_events = num_events
+
+    def __len__(self):
+        return self.num_events
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.num_events
+        if not 0 <= index < self.num_events:
+            raise IndexError("trace index out of range")
+        b = bisect.bisect_right(self.block_starts, index) - 1
+        return self.reader.decode(self.get_blocks()[b], index - self.block_starts[b])
+
+    def __iter__(self):
+        decode = self.reader.decode
+        for block in self.get_blocks():
+            for i in range(len(block.timestamps)):
+                yield decode(block, i)
+
+    # Only the timestamps, without decoding the events
+    def iter_timestamps(self):
+        for block in self.get_blocks():
+            yield from block.timestamps
+
+    def get_blocks(self):
+        if self.blocks is None:
+            raise ValueError("trace file is closed")
+        return self.blocks
+
+    # Releases the view's parts of the memory-mapped file (called by TraceReader.close)
+    def release(self):
+        if self.blocks is not None:
+            for block in self.blocks:
+                block.release()
+            self.blocks = None
+
+# Reads a trace file, by memory-mapping it
+class TraceReader:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+        magic, metadata_size = FILE_HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a trace file: {path}")
+        offset = FILE_HEADER.size + len(padding(FILE_HEADER.size))
+        metadata = json.loads(bytes(self.buffer[offset:offset+metadata_size]))
+        self.name = metadata["name"]
+        offset += metadata_size + len(padding(metadata_size))
+        self.names = [] # event name id -> event name
+        self.strings = [] # string id -> string value
+        blocks = [[], []]
+        while offset < len(self.buffer):
+            tag, trace, num_events, names_size, strings_size = BLOCK_HEADER.unpack_from(self.buffer, offset)
+            if tag != BLOCK_TAG:
+                raise ValueError(f"corrupt trace file: {path}")
+            offset += BLOCK_HEADER.size + len(padding(BLOCK_HEADER.size))
+            def take(size):
+                nonlocal offset
+                part = self.buffer[offset:offset+size]
+                offset += size + len(padding(size))
+                return part
+            self.names += json.loads(bytes(take(names_size)))
+            self.strings += json.loads(bytes(take(strings_size)))
+            timestamps = take(8 * num_events)
+            values = take(8 * num_events)
+            name_ids = take(4 * num_events)
+            types = take(num_events)
+            blocks[trace].append(Block(column(timestamps, 'q'), column(values, 'q'), column(values, 'd'), column(name_ids, 'I'), types))
+        self.input_events = TraceView(self, blocks[INPUT])
+        self.output_events = TraceView(self, blocks[OUTPUT])
+
+    def decode(self, block, i):
+        value_type = block.types[i]
+        if value_type == NONE:
+            value = None
+        elif value_type == INT:
+            value = block.int_values[i]
+        elif value_type == FLOAT:
+            value = block.float_values[i]
+        elif value_type == BOOL:
+            value = bool(block.int_values[i])
+        else:
+            value = self.strings[block.int_values[i]]
+        return (block.timestamps[i], self.names[block.name_ids[i]], value)
+
+    # Returns the trace file as a scenario, like the ones in runner_tests.py
+    def to_scenario(self):
+        return {
+            "name": self.name,
+            "input_events": list(self.input_events),
+            "output_events": list(self.output_events),
+        }
+
+    def close(self):
+        # all views on the memory-mapped file must be released before it can be closed, including the ones in TraceViews that are still referenced elsewhere
+        self.input_events.release()
+        self.output_events.release()
+        self.buffer.release()
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_trace_file(path, name, input_events, output_events):
+    with TraceWriter(path, name) as writer:
+        writer.add_events(INPUT, input_events)
+        writer.add_events(OUTPUT, output_events)
+
+def read_trace_file(path):
+    with TraceReader(path) as reader:
+        return reader.to_scenario()
+
+# Scenario as a Python literal, like the ones in runner_tests.py (and what runner_gui.py prints at the end of a session).
+# Unlike lib.tracer.format_trace_as_python_code, values are written with repr, so that string values can be read back, too.
+def write_python_scenario(path, scenario):
+    with open(path, "w") as f:
+        f.write("{\n")
+        f.write(f'    "name": {scenario["name"]!r},\n')
+        for trace in ("input_events", "output_events"):
+            f.write(f'    "{trace}": [\n')
+            f.writelines('        (%i, "%s", %r),\n' % event for event in scenario[trace])
+            f.write("    ],\n")
+        f.write("}\n")
+
+def read_python_scenario(path):
+    with open(path) as f:
+        scenario = ast.literal_eval(f.read())
+    return {
+        "name": scenario.get("name", ""),
+        "input_events": [tuple(event) for event in scenario["input_events"]],
+        "output_events": [tuple(event) for event in scenario["output_events"]],
+    }
+
+def is_trace_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+# Converts a trace file into a Python literal scenario, or the other way around.
+# Usage (from the StartingPoint directory):
+#   python -m lib.trace_file session.trace session.py
+#   python -m lib.trace_file session.py session.trace
+if __name__ == "__main__":
+    in_path, out_path = sys.argv[1:3]
+    if is_trace_file(in_path):
+        write_python_scenario(out_path, read_trace_file(in_path))
+    else:
+        scenario = read_python_scenario(in_path)
+        write_trace_file(out_path, scenario["name"], scenario["input_events"], scenario["output_events"])
@@ -1,24 +1,176 @@
+import atexit
+import bisect
+import queue
+import sys
+import threading
+
 from lib.controller import pretty_time
 
+def format_event(kind, simtime, event_name, value):
+    return f"time = {pretty_time(simtime)}, {kind} event: {event_name}, value = {value}"
+
 # Records input/output events
 class Tracer:
-    def __init__(self, verbose=True):
+    # printer: if not None, an AsyncEventPrinter that prints the events (if verbose), instead of printing them right away
+    def __init__(self, verbose=True, printer=None):
         self.verbose = verbose
+        self.printer = printer
         self.input_events = []
         self.output_events = []
 
     def record_input_event(self, simtime, event_name, value):
         if self.verbose:
-            print(f"time = {pretty_time(simtime)}, input event: {event_name}, value = {value}")
+            if self.printer is not None:
+                self.printer.put(("input", simtime, event_name, value))
+            else:
+                print(format_event("input", simtime, event_name, value))
         if not event_name.startswith("__timer"):
             # we don't record timer events - they are specific to the statechart (not part of any fixed interface), and they are auto-generated by the timer interface
             self.input_events.append( (simtime, event_name, value) )
 
     def record_output_event(self, simtime, event_name, value):
         if self.verbose:
-            print(f"time = {pretty_time(simtime)}, output event: {event_name}, value = {value}")
+            if self.printer is not None:
+                self.printer.put(("output", simtime, event_name, value))
+            else:
+                print(format_event("output", simtime, event_name, value))
         self.output_events.append( (simtime, event_name, value))
 
+# Prints events (in the same format as Tracer) from a background thread, so that the thread that runs the simulation only has to put them in a queue.
+# Formatting and writing happens in batches of up to 'batch_size' events: every batch is written with a single write (and flush) of 'stream' (default: sys.stdout).
+# Because of this, lines printed by other threads in the meantime may appear before events that were put earlier. Call flush() to wait until everything put so far has been written.
+# The printer is closed (flushing the remaining events) when the program exits, unless it has been closed before.
+class AsyncEventPrinter:
+    def __init__(self, stream=None, batch_size=1000):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.put = self.queue.put # (kind, simtime, event_name, value)-tuples, kind being "input" or "output"
+        self.thread = threading.Thread(target=self.write_batches, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write_batches(self):
+        get, get_nowait = self.queue.get, self.queue.get_nowait
+        while True:
+            batch = [get()] # block until there is something to print
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(get_nowait())
+            except queue.Empty:
+                pass
+            lines = []
+            waiting = [] # threading.Events of flush() calls
+            done = False
+            for item in batch:
+                if item is None:
+                    done = True # close() was called
+                elif isinstance(item, threading.Event):
+                    waiting.append(item)
+                else:
+                    lines.append(format_event(*item) + "\n")
+            if lines:
+                stream = self.stream or sys.stdout
+                stream.write("".join(lines))
+                stream.flush()
+            for written in waiting:
+                written.set()
+            if done:
+                return
+
+    # Blocks until all events that were put so far, have been written
+    def flush(self):
+        if self.thread.is_alive():
+            written = threading.Event()
+            self.put(written)
+            written.wait()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.put(None)
+            self.thread.join()
+        atexit.unregister(self.close)
+
+# Fixed-size FIFO of (timestamp, event_name, value)-tuples: once it is full, every appended event evicts the oldest one.
+# The slots are allocated up front, so memory use does not grow, no matter how many events are appended.
+class EventRingBuffer:
+    def __init__(self, capacity, on_evict=None):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.start = 0 # slot of the oldest event
+        self.size = 0
+        self.num_evicted = 0
+        self.on_evict = on_evict # called with every evicted event
+
+    def append(self, event):
+        if self.size < self.capacity:
+            self.slots[(self.start + self.size) % self.capacity] = event
+            self.size += 1
+        else:
+            evicted = self.slots[self.start]
+            self.slots[self.start] = event
+            self.start = (self.start + 1) % self.capacity
+            self.num_evicted += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("ring buffer index out of range")
+        return self.slots[(self.start + index) % self.capacity]
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.slots[(self.start + index) % self.capacity]
+
+    # The events with a timestamp >= 'timestamp' (events must have been appended in order of their timestamps)
+    def since(self, timestamp):
+        first = bisect.bisect_left(self, timestamp, key=lambda event: event[0])
+        return [self[index] for index in range(first, self.size)]
+
+# Same as Tracer, but only remembers the last 'capacity' input events and the last 'capacity' output events, for long-running (e.g., interactive) simulations.
+# If 'spill_writer' (e.g., a lib.trace_file.TraceWriter) is given, the events that no longer fit are recorded by it, and so are the events still in memory when the tracer is closed, so that no event is lost.
+class RingBufferTracer(Tracer):
+    def __init__(self, capacity, verbose=True, spill_writer=None, printer=None):
+        super().__init__(verbose, printer)
+        self.spill_writer = spill_writer
+        if spill_writer is None:
+            self.input_events = EventRingBuffer(capacity)
+            self.output_events = EventRingBuffer(capacity)
+        else:
+            self.input_events = EventRingBuffer(capacity, on_evict=lambda event: spill_writer.record_input_event(*event))
+            self.output_events = EventRingBuffer(capacity, on_evict=lambda event: spill_writer.record_output_event(*event))
+
+    # Whether events have been evicted (and are therefore missing from input_events or output_events)
+    def is_truncated(self):
+        return self.input_events.num_evicted > 0 or self.output_events.num_evicted > 0
+
+    # The events of the last 'duration' nanoseconds of simulated time, up to 'now' (default: the timestamp of the last recorded event), e.g., for a bug report.
+    # Returns a scenario, like the ones in runner_tests.py (but, of course, starting in the middle of a simulation).
+    def snapshot(self, duration, now=None):
+        if now is None:
+            now = max([events[-1][0] for events in (self.input_events, self.output_events) if len(events)], default=0)
+        return {
+            "name": f"snapshot of {pretty_time(now - duration)} until {pretty_time(now)}",
+            "input_events": [event for event in self.input_events.since(now - duration) if event[0] <= now],
+            "output_events": [event for event in self.output_events.since(now - duration) if event[0] <= now],
+        }
+
+    # Hands all events that are still in memory to the spill writer (they remain in memory as well), and closes it
+    def close(self):
+        if self.spill_writer is not None:
+            for event in self.input_events:
+                self.spill_writer.record_input_event(*event)
+            for event in self.output_events:
+                self.spill_writer.record_output_event(*event)
+            self.spill_writer.close()
+            self.spill_writer = None
+
 
 def format_trace_as_python_code(trace, indent=0):
     txt = "[\n"
@@ -1,7 +1,12 @@
 # In this module, stuff that is specific to Yakindu's generated code
 # Author: Joeri Exelmans
 
+import collections
+import queue
+import threading
+
 from lib.controller import Controller, pretty_time
+from lib.timing_wheel import TimingWheel
 
 # for some stupid reason, we have to import the 'Observable' class like this, or `type(obj) == Observable` will fail:
 import sys, os
@@ -25,16 +30,84 @@ class YakinduTimerServiceAdapter:
             self.controller.simulated_time + controller_duration, # timestamp relative to simulated time
             raise_method=sc.time_elapsed,
             value=event_id,
-            event_name="__timer"+str(event_id))
+            event_name="__timer"+str(event_id),
+            sc=sc)
+        if periodic:
+            e.period = controller_duration
 
         self.timers[event_id] = e
 
     def unset_timer(self, _, event_id):
-        try:
-            e = self.timers[event_id]
-            e.canceled = True
-        except KeyError:
-            pass
+        e = self.timers.pop(event_id, None)
+        if e is not None:
+            self.controller.cancel(e)
+
+# Alternative to YakinduTimerServiceAdapter, backed by a hierarchical timing wheel: (un)setting a timer is O(1), no matter how many timers are running.
+# Only pick it if timers are canceled (or re-armed) a lot more often than they expire, and there are many of them: from about 10^4 running timers on, it re-arms faster than YakinduTimerServiceAdapter (see the 'timer_churn' benchmark in runner_benchmarks.py).
+# If most timers expire (e.g., thousands of LockControllers that blink their lights), every timer still ends up in the event queue, so the wheel only adds work: it is about 15-20% slower then (see the 'timer_services' benchmark).
+# Unlike YakinduTimerServiceAdapter, a single instance can (and should) be shared by all statecharts that run on the same Controller.
+# Timers fire at exactly the same simulated time, and in the same order w.r.t. other events, as with YakinduTimerServiceAdapter.
+class YakinduTimingWheelTimerService:
+    def __init__(self, controller: Controller, resolution=1000000):
+        self.controller = controller
+        self.wheel = TimingWheel(controller, resolution)
+        self.timers = {}
+
+    # Duration: milliseconds
+    def set_timer(self, sc, event_id, duration, periodic):
+        self.unset_timer(sc, event_id)
+
+        controller_duration = duration * 1000000 # ms to ns
+
+        e = self.wheel.add(
+            self.controller.simulated_time + controller_duration, # timestamp relative to simulated time
+            raise_method=sc.time_elapsed,
+            value=event_id,
+            event_name="__timer"+str(event_id),
+            sc=sc)
+        if periodic:
+            e.period = controller_duration
+
+        self.timers[(sc, event_id)] = e
+
+    def unset_timer(self, sc, event_id):
+        e = self.timers.pop((sc, event_id), None)
+        if e is not None:
+            self.wheel.remove(e)
+
+
+# Drop-in replacement for the queue.Queue objects that Yakindu's generated code uses for its input and internal event queues.
+# queue.Queue acquires a mutex (and notifies a condition variable) on every put/get/empty, which is useless if the statechart is only ever used from one thread, as is the case when it is driven by a Controller.
+class EventDeque(collections.deque):
+    put = collections.deque.append
+    get = collections.deque.popleft
+    def empty(self):
+        return not self
+
+# Same, but every operation holds a lock. Only needed if events are raised on the statechart from different threads.
+class LockedEventDeque(EventDeque):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+    def put(self, item):
+        with self.lock:
+            self.append(item)
+    def get(self):
+        with self.lock:
+            return self.popleft()
+    def empty(self):
+        with self.lock:
+            return not self
+
+# Replaces the (still empty) event queues of a freshly constructed generated statechart by EventDeques.
+# The generated code does not have to be changed (or re-generated) for this.
+def use_event_deques(sc, thread_safe=False):
+    for attr, obj in list(vars(sc).items()):
+        if type(obj) == queue.Queue:
+            new_queue = LockedEventDeque() if thread_safe else EventDeque()
+            while not obj.empty():
+                new_queue.put(obj.get())
+            setattr(sc, attr, new_queue)
 
 
 # Could not find a better way to get list of output events of a YAKINDU statechart
@@ -0,0 +1,797 @@
+# Loads Yakindu / itemis CREATE statechart models (.ysc files, sgraph XMI) directly, without generating code first.
+#
+# A model is compiled into a flat, table-driven state machine:
+#   - states are numbered in the same order as in the generated code (pre-order, document order), and the state vector has the same layout
+#   - for every leaf state, its outgoing transitions are stored in a table indexed by [state id][event id]
+#   - guards, actions, entry and exit actions are compiled into Python functions (i.e., bytecode) once, when the model is loaded
+# The resulting class has the same public API as the class generated by itemis CREATE ('enter', 'exit', 'raise_*', '*_observable', 'timer_service', 'time_elapsed', ...), and, for the supported subset of the language, the same behavior (i.e., the same output events, in the same order, at the same time).
+#
+# Supported subset:
+#   - @EventDriven statecharts, without super steps, with child-first (default) or @ParentFirstExecution semantics
+#   - const, var, in/out/internal events (with or without parameter), in the default (unnamed) interface and in the internal scope
+#   - states (simple and orthogonal/composite), default entries, transitions between states of the same region
+#   - triggers: events, 'after' and 'every', 'always'/'oncycle'; guards; entry and exit actions; 'raise', assignments, 'valueof', 'active'
+# Anything else (choices, history, final states, named interfaces, local reactions, operations, ...) raises NotImplementedError when the model is loaded.
+
+import functools
+import os
+import queue
+import re
+import xml.etree.ElementTree as ET
+
+from lib.yakindu_helpers import Observable
+
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+XMI_ID = '{http://www.omg.org/XMI}id'
+
+TIME_UNITS = { 's': 1000, 'ms': 1, 'us': 0.001, 'ns': 0.000001 } # to milliseconds, as expected by the timer service
+
+# Returns a class that behaves like the class that itemis CREATE would generate from the given .ysc file.
+# The model is only parsed and compiled once per file.
+def load_ysc(path):
+    return load_ysc_cached(os.path.abspath(path))
+
+@functools.cache
+def load_ysc_cached(path):
+    model = compile_model(path)
+    namespace = {
+        'model': model,
+        'State': model.state_enum,
+        'react': react_parent_first if model.parent_first else react_child_first,
+    }
+    for event_name, event_id in model.in_events.items():
+        namespace['raise_' + event_name] = make_record_raise_method(event_id, 'in_event_queue',
+            has_value=model.value_attrs[event_id] is not None,
+            run_cycle=True)
+    for event_name, event_id in model.internal_events.items():
+        namespace['raise_' + event_name] = make_record_raise_method(event_id, 'internal_event_queue',
+            has_value=model.value_attrs[event_id] is not None,
+            run_cycle=False)
+    return type(model.name, (InterpretedStatechart,), namespace)
+
+
+# Raise methods put compact records in the event queue, instead of closures: an int 'event_id' for events without a parameter value, an (event_id, value)-tuple otherwise
+def make_record_raise_method(event_id, queue_attr, has_value, run_cycle):
+    if has_value:
+        def raise_method(self, value):
+            getattr(self, queue_attr).put((event_id, value))
+            if run_cycle:
+                self.run_cycle()
+    else:
+        def raise_method(self):
+            getattr(self, queue_attr).put(event_id)
+            if run_cycle:
+                self.run_cycle()
+    return raise_method
+
+
+# Run-time behavior, shared by all loaded models. Everything model-specific is looked up in the tables of 'self.model'.
+class InterpretedStatechart:
+    def __init__(self):
+        model = self.model
+        self.in_event_queue = queue.Queue()
+        self.internal_event_queue = queue.Queue()
+        for attr in model.value_attrs:
+            if attr is not None:
+                setattr(self, attr, None)
+        for event_name in model.out_events:
+            setattr(self, event_name + '_observable', Observable())
+        self.state_vector = [model.null_state] * model.num_slots
+        self.state_conf_vector_position = None
+        self.timer_service = None
+        self.is_executing = False
+        model.init_variables(self)
+
+    def is_active(self):
+        return any(state != self.model.null_state for state in self.state_vector)
+
+    def is_final(self):
+        return False
+
+    def is_state_active(self, state):
+        model = self.model
+        if state >= model.null_state:
+            return False
+        return state <= self.state_vector[model.slot[state]] <= model.subtree_end[state]
+
+    def time_elapsed(self, event_id):
+        if 0 <= event_id < self.model.num_time_events:
+            self.in_event_queue.put(self.model.time_event_base + event_id)
+            self.run_cycle()
+
+    def get_next_event(self):
+        if not self.internal_event_queue.empty():
+            record = self.internal_event_queue.get()
+        elif not self.in_event_queue.empty():
+            record = self.in_event_queue.get()
+        else:
+            return self.model.no_event
+        if type(record) is tuple:
+            event_id, value = record
+            setattr(self, self.model.value_attrs[event_id], value)
+            return event_id
+        return record
+
+    def run_cycle(self):
+        if self.timer_service is None:
+            raise ValueError('Timer service must be set.')
+        if self.is_executing:
+            return
+        self.is_executing = True
+        no_event = self.model.no_event
+        event = self.get_next_event()
+        while True:
+            self.micro_step(event)
+            event = self.get_next_event()
+            if event == no_event:
+                break
+        self.is_executing = False
+
+    def micro_step(self, event):
+        is_leaf = self.model.is_leaf
+        vector = self.state_vector
+        transitioned = -1
+        self.state_conf_vector_position = 0
+        for slot in range(len(vector)):
+            if slot and self.state_conf_vector_position >= slot:
+                continue
+            state = vector[slot]
+            if is_leaf[state]:
+                transitioned = self.react(state, transitioned, event)
+
+    def fire(self, t):
+        self.exit_state(t.source)
+        if t.action is not None:
+            t.action(self)
+        self.enter_state(t.target)
+
+    def enter_state(self, state):
+        model = self.model
+        entry_action = model.entry_actions[state]
+        if entry_action is not None:
+            entry_action(self)
+        if model.is_leaf[state]:
+            slot = model.slot[state]
+            self.state_vector[slot] = state
+            self.state_conf_vector_position = slot
+        else:
+            for region in model.regions[state]:
+                self.enter_region(region)
+
+    def enter_region(self, region):
+        if region.entry_action is not None:
+            region.entry_action(self)
+        self.enter_state(region.default_state)
+
+    def exit_state(self, state):
+        model = self.model
+        slot = model.slot[state]
+        if model.is_leaf[state]:
+            self.state_vector[slot] = model.parent_or_null[state]
+            self.state_conf_vector_position = slot
+        else:
+            for region in model.regions[state]:
+                self.exit_region(region)
+            self.state_vector[slot] = model.parent_or_null[state]
+        exit_action = model.exit_actions[state]
+        if exit_action is not None:
+            exit_action(self)
+
+    def exit_region(self, region):
+        model = self.model
+        # walk up from the active leaf state in the region's first slot, to the active state of the region itself:
+        state = self.state_vector[region.offset]
+        while state != model.null_state and model.region_of[state] is not region:
+            state = model.parent_or_null[state]
+        if state != model.null_state:
+            self.exit_state(state)
+
+    def enter(self):
+        if self.timer_service is None:
+            raise ValueError('Timer service must be set.')
+        if self.is_executing:
+            return
+        self.is_executing = True
+        for region in self.model.root_regions:
+            self.enter_region(region)
+        self.is_executing = False
+
+    def exit(self):
+        if self.is_executing:
+            return
+        self.is_executing = True
+        for region in self.model.root_regions:
+            self.exit_region(region)
+        for slot in range(self.model.num_slots):
+            self.state_vector[slot] = self.model.null_state
+        self.state_conf_vector_position = self.model.num_slots - 1
+        self.is_executing = False
+
+    def trigger_without_event(self):
+        self.run_cycle()
+
+# A state reacts to an event by trying its outgoing transitions, and by letting its parent state react.
+# Which of both goes first, depends on the execution order of the model (same as in the generated '__..._react'-methods).
+# 'transitioned_before' is the highest state vector position at which a transition was taken already during this micro step (or -1). A state that lies (partially) before that position, must not take a transition anymore.
+def react_child_first(self, state, transitioned_before, event):
+    model = self.model
+    transitioned_after = transitioned_before
+    offset = model.slot[state]
+    if transitioned_before < offset:
+        for t in model.transitions[state][event]:
+            if t.guard is None or t.guard(self, event):
+                self.fire(t)
+                if model.reacts_with_parent[state]:
+                    parent = model.parent[state]
+                    self.react(parent, model.slot[parent], event)
+                transitioned_after = offset
+                break
+    if transitioned_after == transitioned_before and model.reacts_with_parent[state]:
+        transitioned_after = self.react(model.parent[state], transitioned_before, event)
+    return transitioned_after
+
+def react_parent_first(self, state, transitioned_before, event):
+    model = self.model
+    if model.reacts_with_parent[state]:
+        transitioned_after = self.react(model.parent[state], transitioned_before, event)
+    else:
+        transitioned_after = transitioned_before
+    offset = model.slot[state]
+    if transitioned_after < offset:
+        for t in model.transitions[state][event]:
+            if t.guard is None or t.guard(self, event):
+                self.fire(t)
+                return offset
+    return transitioned_after
+
+
+class Transition:
+    __slots__ = ('source', 'target', 'guard', 'action')
+    def __init__(self, source, target, guard, action):
+        self.source = source
+        self.target = target
+        self.guard = guard # function (sc, event_id) -> bool, or None
+        self.action = action # function (sc), or None
+
+class Region:
+    def __init__(self, name, owner, offset):
+        self.name = name
+        self.owner = owner # state id of the composite state, or None for the statechart itself
+        self.offset = offset # first state vector position
+        self.width = 0 # number of state vector positions
+        self.entry_vertex = None # XML element of the default entry
+        self.default_state = None
+        self.entry_action = None # actions of the default entry's transition
+
+# The compiled tables of a model. All per-state lists are indexed by state id, and have an extra element for the 'null state'.
+class Model:
+    def __init__(self, name):
+        self.name = name
+        self.parent_first = False
+        self.constants = {}
+        self.variables = {}
+        self.in_events = {} # event name -> event id
+        self.internal_events = {} # event name -> event id
+        self.out_events = {} # event name -> has value
+        self.value_attrs = [] # event id -> name of the attribute that holds the event's parameter value, or None
+        self.num_time_events = 0
+        self.time_event_base = None # event id of time event 0
+        self.no_event = None # event id used for a micro step without event
+        self.state_names = [] # qualified names (snake case), as in the generated code
+        self.state_paths = [] # path of (region name, state name)-pairs
+        self.parent = []
+        self.parent_or_null = []
+        self.region_of = []
+        self.regions = []
+        self.slot = []
+        self.subtree_end = []
+        self.is_leaf = []
+        self.reacts_with_parent = []
+        self.entry_actions = []
+        self.exit_actions = []
+        self.transitions = [] # [state id][event id] -> tuple of Transitions, in document order
+        self.root_regions = []
+        self.num_slots = 0
+        self.null_state = None
+        self.state_enum = None
+        self.init_variables = None
+
+
+def compile_model(path):
+    root = ET.parse(path).getroot()
+    statechart = next((e for e in root if e.tag.endswith('Statechart')), None)
+    if statechart is None:
+        raise ValueError(f"{path}: no statechart found")
+    model = Model(statechart.get('name'))
+    Compiler(path, model).compile(statechart)
+    return model
+
+# Turns 'camelCase' into 'snake_case', like the code generator does. Names in all caps (constants) are left alone.
+def to_snake_case(name):
+    name = name.strip().replace(' ', '_')
+    if name.isupper():
+        return name
+    return re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', name).lower()
+
+class Compiler:
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.state_ids = {} # XMI id -> state id
+        self.timers = {} # state id -> list of (time event id, duration source, periodic)
+        self.state_elements = [] # state id -> XML element
+        self.widths = [] # state id -> number of state vector positions
+
+    def compile(self, statechart):
+        model = self.model
+        self.compile_declarations(statechart.get('specification') or '')
+
+        # number the states and lay out the state vector:
+        for region_element in statechart.findall('regions'):
+            region = self.add_region(region_element, None, model.num_slots, ())
+            model.root_regions.append(region)
+            model.num_slots += region.width
+        model.null_state = len(model.state_names)
+        model.state_enum = type('State', (), {name: state for state, name in enumerate(model.state_names + ['null_state'])})
+        for table in (model.parent_or_null, model.region_of, model.slot, model.subtree_end, model.entry_actions, model.exit_actions):
+            table.append(None)
+        model.parent_or_null[:] = [model.null_state if parent is None else parent for parent in model.parent] + [None]
+        model.is_leaf.append(False)
+        model.regions.append(())
+        model.reacts_with_parent.append(False)
+
+        # the time events are numbered in the same order as in the generated code: per state, per transition
+        parsed_transitions = []
+        for state, element in enumerate(self.state_elements):
+            for transition_element in element.findall('outgoingTransitions'):
+                triggers, guard, actions = Parser(self, transition_element.get('specification') or '', self.describe(state)).parse_transition()
+                for i, (kind, trigger) in enumerate(triggers):
+                    if kind in ('after', 'every'):
+                        self.timers[state].append((model.num_time_events, trigger, kind == 'every'))
+                        triggers[i] = ('time', model.num_time_events)
+                        model.num_time_events += 1
+                parsed_transitions.append((state, transition_element, triggers, guard, actions))
+        model.time_event_base = len(model.value_attrs)
+        model.value_attrs.extend([None] * model.num_time_events)
+        model.no_event = len(model.value_attrs)
+        model.value_attrs.append(None)
+
+        num_columns = model.no_event + 1
+        model.transitions = [[[] for _ in range(num_columns)] for _ in range(model.null_state)]
+        for (state, transition_element, triggers, guard, actions) in parsed_transitions:
+            self.add_transition(state, transition_element, triggers, guard, actions)
+        model.transitions = [[tuple(column) for column in columns] for columns in model.transitions] + [None]
+
+        for state, element in enumerate(self.state_elements):
+            self.compile_state_actions(state, element)
+        self.compile_default_entries()
+
+    def describe(self, state):
+        return f"{self.path}: state '{'.'.join(name for _, name in self.model.state_paths[state])}'"
+
+    def compile_declarations(self, text):
+        model = self.model
+        annotations = {}
+        init_lines = []
+        # every declaration is registered before the next one is parsed, so that e.g. the initial value of a variable can refer to a constant
+        for kind, name, var_type, initial_value in Parser(self, text, f"{self.path}: statechart declarations").parse_declarations():
+            attr = to_snake_case(name)
+            if kind == '@':
+                annotations[name] = var_type
+            elif kind in ('in', 'event'):
+                events = model.in_events if kind == 'in' else model.internal_events
+                events[attr] = len(model.value_attrs)
+                model.value_attrs.append(attr + '_value' if var_type is not None else None)
+            elif kind == 'out':
+                model.out_events[attr] = var_type is not None
+            else:
+                if initial_value is None:
+                    initial_value = { 'integer': '0', 'real': '0.0', 'boolean': 'False', 'string': "''" }.get(var_type, 'None')
+                (model.constants if kind == 'const' else model.variables)[attr] = name
+                init_lines.append(f"self.{attr} = {initial_value}")
+        if 'EventDriven' not in annotations:
+            raise NotImplementedError(f"{self.path}: only @EventDriven statecharts are supported")
+        if (annotations.get('SuperSteps') or 'no') != 'no':
+            raise NotImplementedError(f"{self.path}: super steps are not supported")
+        model.parent_first = 'ParentFirstExecution' in annotations
+        model.init_variables = self.make_function('init_variables', init_lines, f"{self.path}: statechart declarations")
+
+    def add_region(self, element, owner, offset, path):
+        model = self.model
+        region = Region(element.get('name'), owner, offset)
+        states = []
+        entry = None
+        for vertex in element.findall('vertices'):
+            vertex_type = vertex.get(XSI_TYPE)
+            if vertex_type == 'sgraph:State':
+                states.append(vertex)
+            elif vertex_type == 'sgraph:Entry' and (vertex.get('kind') or 'Initial') == 'Initial':
+                entry = vertex
+            else:
+                raise NotImplementedError(f"{self.path}: region '{region.name}': {vertex_type} is not supported")
+        for vertex in states:
+            state = self.add_state(vertex, region, path + ((region.name, vertex.get('name')),))
+            region.width = max(region.width, self.widths[state])
+        if entry is None:
+            raise NotImplementedError(f"{self.path}: region '{region.name}' has no default entry")
+        region.entry_vertex = entry
+        return region
+
+    def add_state(self, element, region, path):
+        model = self.model
+        state = len(model.state_names)
+        self.state_ids[element.get(XMI_ID)] = state
+        self.state_elements.append(element)
+        self.widths.append(1)
+        self.timers[state] = []
+        model.state_names.append('_'.join(to_snake_case(region_name) + '_' + to_snake_case(state_name) for region_name, state_name in path).lower())
+        model.state_paths.append(path)
+        model.parent.append(region.owner)
+        model.region_of.append(region)
+        model.slot.append(region.offset)
+        model.subtree_end.append(state)
+        model.is_leaf.append(True)
+        model.regions.append(())
+        model.entry_actions.append(None)
+        model.exit_actions.append(None)
+        model.reacts_with_parent.append(False)
+
+        region_elements = element.findall('regions')
+        if region_elements:
+            model.is_leaf[state] = False
+            regions = []
+            offset = region.offset
+            for region_element in region_elements:
+                child_region = self.add_region(region_element, state, offset, path)
+                regions.append(child_region)
+                offset += child_region.width
+            model.regions[state] = tuple(regions)
+            self.widths[state] = offset - region.offset
+            model.subtree_end[state] = len(model.state_names) - 1
+            # Only one region of a composite state makes its states react with the composite state: the last one (child first), or the first one (parent first)
+            reacting_region = regions[0] if model.parent_first else regions[-1]
+            for child in range(state + 1, len(model.state_names)):
+                model.reacts_with_parent[child] = model.parent[child] == state and model.region_of[child] is reacting_region
+        return state
+
+    def add_transition(self, state, element, triggers, guard, actions):
+        model = self.model
+        target = self.state_ids.get(element.get('target'))
+        if target is None:
+            raise NotImplementedError(f"{self.describe(state)}: transitions to pseudostates are not supported")
+        if model.region_of[target] is not model.region_of[state]:
+            raise NotImplementedError(f"{self.describe(state)}: transitions across region boundaries are not supported")
+        # the event ids for which the transition is enabled (i.e., the table columns it appears in):
+        columns = range(model.no_event + 1) # no trigger: every event, and also no event at all
+        if triggers and all(kind in ('event', 'time') for kind, _ in triggers):
+            columns = [trigger if kind == 'event' else model.time_event_base + trigger for kind, trigger in triggers]
+        t = Transition(state, target,
+            guard=self.make_function('guard', ['return ' + guard], self.describe(state), params='self, event') if guard is not None else None,
+            action=self.make_function('action', actions, self.describe(state)) if actions else None)
+        for column in columns:
+            model.transitions[state][column].append(t)
+
+    def compile_state_actions(self, state, element):
+        model = self.model
+        entry_lines = []
+        exit_lines = []
+        for time_event, duration, periodic in self.timers[state]:
+            entry_lines.append(f"self.timer_service.set_timer(self, {time_event}, {duration}, {periodic})")
+            exit_lines.append(f"self.timer_service.unset_timer(self, {time_event})")
+        reactions = Parser(self, element.get('specification') or '', self.describe(state)).parse_state_reactions()
+        for kind, lines in reactions:
+            (entry_lines if kind == 'entry' else exit_lines).extend(lines)
+        if entry_lines:
+            model.entry_actions[state] = self.make_function('entry_action', entry_lines, self.describe(state))
+        if exit_lines:
+            model.exit_actions[state] = self.make_function('exit_action', exit_lines, self.describe(state))
+
+    def compile_default_entries(self):
+        model = self.model
+        regions = list(model.root_regions)
+        for state_regions in model.regions:
+            regions.extend(state_regions)
+        for region in regions:
+            transitions = region.entry_vertex.findall('outgoingTransitions')
+            if len(transitions) != 1:
+                raise NotImplementedError(f"{self.path}: the default entry of region '{region.name}' must have exactly one outgoing transition")
+            target = self.state_ids.get(transitions[0].get('target'))
+            if target is None or model.region_of[target] is not region:
+                raise NotImplementedError(f"{self.path}: the default entry of region '{region.name}' must point to a state in the same region")
+            region.default_state = target
+            triggers, guard, actions = Parser(self, transitions[0].get('specification') or '', f"{self.path}: default entry of region '{region.name}'").parse_transition()
+            if triggers or guard is not None:
+                raise NotImplementedError(f"{self.path}: the default entry of region '{region.name}' cannot have a trigger or guard")
+            if actions:
+                region.entry_action = self.make_function('entry_action', actions, f"{self.path}: default entry of region '{region.name}'")
+
+    def make_function(self, name, lines, filename, params='self'):
+        source = f"def {name}({params}):\n" + ''.join(f"    {line}\n" for line in lines or ['pass'])
+        namespace = {}
+        exec(compile(source, filename, 'exec'), namespace)
+        return namespace[name]
+
+    # Name resolution, used by the Parser
+
+    def resolve_name(self, name, where):
+        model = self.model
+        attr = to_snake_case(name)
+        if attr in model.constants or attr in model.variables:
+            return f"self.{attr}"
+        if attr in model.in_events or attr in model.internal_events:
+            # an event used as a boolean expression: is it the event that is being handled?
+            return f"(event == {self.resolve_event(name, where)})"
+        raise ValueError(f"{where}: unknown name '{name}'")
+
+    def resolve_event(self, name, where):
+        model = self.model
+        attr = to_snake_case(name)
+        event_id = model.in_events.get(attr, model.internal_events.get(attr))
+        if event_id is None:
+            raise ValueError(f"{where}: unknown input or internal event '{name}'")
+        return event_id
+
+    def resolve_variable(self, name, where):
+        attr = to_snake_case(name)
+        if attr not in self.model.variables:
+            raise ValueError(f"{where}: '{name}' is not a variable")
+        return f"self.{attr}"
+
+    def resolve_value(self, name, where):
+        attr = self.model.value_attrs[self.resolve_event(name, where)]
+        if attr is None:
+            raise ValueError(f"{where}: event '{name}' has no value")
+        return f"self.{attr}"
+
+    def resolve_raise(self, name, value, where):
+        model = self.model
+        attr = to_snake_case(name)
+        if attr in model.out_events:
+            return f"self.{attr}_observable.next({value or ''})"
+        event_id = self.resolve_event(name, where)
+        queue_attr = 'internal_event_queue' if attr in model.internal_events else 'in_event_queue'
+        return f"self.{queue_attr}.put({event_id if value is None else f'({event_id}, {value})'})"
+
+    def resolve_active(self, qualified_name, where):
+        model = self.model
+        names = qualified_name.split('.')
+        matches = [state for state, path in enumerate(model.state_paths)
+            if [name for pair in path for name in pair][-len(names):] == names
+            or [name for _, name in path][-len(names):] == names]
+        if len(matches) != 1:
+            raise ValueError(f"{where}: cannot resolve state '{qualified_name}'")
+        state = matches[0]
+        slot = model.slot[state]
+        if model.is_leaf[state]:
+            return f"(self.state_vector[{slot}] == {state})"
+        return f"({state} <= self.state_vector[{slot}] <= {model.subtree_end[state]})"
+
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+    |(?P<number>\d+\.\d*|\d+)
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*(?:\.[A-Za-z_][A-Za-z_0-9]*)*)
+    |(?P<op>==|!=|<=|>=|&&|\|\||\+=|-=|\*=|/=|%=|[-+*/%<>=!?:;,()\[\]@])
+''', re.VERBOSE | re.DOTALL)
+
+def tokenize(text, where):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = TOKEN_REGEX.match(text, pos)
+        if match is None:
+            raise ValueError(f"{where}: unexpected character {text[pos]!r}")
+        if match.lastgroup != 'skip':
+            tokens.append(match.group())
+        pos = match.end()
+    return tokens
+
+# Recursive descent parser for the subset of the Yakindu expression language we support.
+# Expressions and statements are translated to Python source code.
+class Parser:
+    BINARY_OPERATORS = [ # lowest precedence first
+        { '||': 'or' },
+        { '&&': 'and' },
+        { '==': '==', '!=': '!=' },
+        { '<': '<', '<=': '<=', '>': '>', '>=': '>=' },
+        { '+': '+', '-': '-' },
+        { '*': '*', '/': '/', '%': '%' },
+    ]
+    ASSIGNMENT_OPERATORS = { '=': '', '+=': '+', '-=': '-', '*=': '*', '/=': '/', '%=': '%' }
+    REACTION_KEYWORDS = ('entry', 'exit', 'always', 'oncycle', 'after', 'every')
+
+    def __init__(self, compiler, text, where):
+        self.compiler = compiler
+        self.where = where
+        self.tokens = tokenize(text, where)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError(f"{self.where}: unexpected end of specification")
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        actual = self.next()
+        if actual != token:
+            raise ValueError(f"{self.where}: expected '{token}', got '{actual}'")
+
+    def expect_name(self):
+        token = self.next()
+        if not re.fullmatch(r'[A-Za-z_][\w.]*', token):
+            raise ValueError(f"{self.where}: expected a name, got '{token}'")
+        return token
+
+    # Statechart specification: annotations and declarations
+    # Yields (kind, name, type, initial value) for every declaration, and ('@', name, argument, None) for every annotation
+    def parse_declarations(self):
+        while self.peek() is not None:
+            token = self.next()
+            if token == '@':
+                name = self.expect_name()
+                argument = None
+                if self.peek() == '(':
+                    self.next()
+                    argument = self.expect_name()
+                    self.expect(')')
+                yield ('@', name, argument, None)
+            elif token in ('interface', 'internal'):
+                if self.peek() != ':':
+                    raise NotImplementedError(f"{self.where}: named interfaces are not supported")
+                self.next()
+            elif token in ('const', 'var'):
+                if self.peek() == 'readonly':
+                    self.next()
+                name = self.expect_name()
+                var_type = None
+                if self.peek() == ':':
+                    self.next()
+                    var_type = self.expect_name()
+                initial_value = None
+                if self.peek() == '=':
+                    self.next()
+                    initial_value = self.parse_expression()
+                yield (token, name, var_type, initial_value)
+            elif token in ('in', 'out', 'event'):
+                if token != 'event':
+                    self.expect('event')
+                name = self.expect_name()
+                event_type = None
+                if self.peek() == ':':
+                    self.next()
+                    event_type = self.expect_name()
+                yield (token, name, event_type, None)
+            else:
+                raise NotImplementedError(f"{self.where}: '{token}' is not supported")
+
+    # Transition specification: "triggers [guard] / actions"
+    # Returns (triggers: list of (kind, event id or duration source), guard source or None, list of action source lines)
+    def parse_transition(self):
+        triggers = []
+        guard = None
+        actions = []
+        if self.peek() not in (None, '[', '/'):
+            triggers = self.parse_triggers()
+        if self.peek() == '[':
+            self.next()
+            guard = self.parse_expression()
+            self.expect(']')
+        if self.peek() == '/':
+            self.next()
+            actions = self.parse_statements()
+        if self.peek() is not None:
+            raise ValueError(f"{self.where}: unexpected '{self.peek()}'")
+        return triggers, guard, actions
+
+    def parse_triggers(self):
+        triggers = []
+        while True:
+            token = self.next()
+            if token in ('after', 'every'):
+                duration = self.parse_expression()
+                unit = self.next()
+                if unit not in TIME_UNITS:
+                    raise ValueError(f"{self.where}: unknown time unit '{unit}'")
+                if TIME_UNITS[unit] != 1:
+                    duration = f"({duration} * {TIME_UNITS[unit]})"
+                triggers.append((token, duration))
+            elif token in ('always', 'oncycle'):
+                triggers.append((token, None))
+            else:
+                triggers.append(('event', self.compiler.resolve_event(token, self.where)))
+            if self.peek() != ',':
+                return triggers
+            self.next()
+
+    # State specification: "entry / actions" and "exit / actions" reactions
+    # Returns list of ('entry' or 'exit', list of action source lines)
+    def parse_state_reactions(self):
+        reactions = []
+        while self.peek() is not None:
+            kind = self.next()
+            if kind not in ('entry', 'exit'):
+                raise NotImplementedError(f"{self.where}: only entry and exit actions are supported in a state, not '{kind}'")
+            self.expect('/')
+            reactions.append((kind, self.parse_statements()))
+        return reactions
+
+    def parse_statements(self):
+        lines = []
+        while self.peek() is not None and self.peek() not in self.REACTION_KEYWORDS:
+            lines.append(self.parse_statement())
+            if self.peek() == ';':
+                self.next()
+        return lines
+
+    def parse_statement(self):
+        if self.peek() == 'raise':
+            self.next()
+            name = self.expect_name()
+            value = None
+            if self.peek() == ':':
+                self.next()
+                value = self.parse_expression()
+            return self.compiler.resolve_raise(name, value, self.where)
+        if self.peek(1) in self.ASSIGNMENT_OPERATORS:
+            target = self.compiler.resolve_variable(self.next(), self.where)
+            operator = self.ASSIGNMENT_OPERATORS[self.next()]
+            value = self.parse_expression()
+            if operator:
+                value = f"({target} {operator} {value})"
+            return f"{target} = {value}"
+        raise NotImplementedError(f"{self.where}: unsupported statement starting with '{self.peek()}'")
+
+    def parse_expression(self):
+        condition = self.parse_binary(0)
+        if self.peek() == '?':
+            self.next()
+            if_true = self.parse_expression()
+            self.expect(':')
+            if_false = self.parse_expression()
+            return f"({if_true} if {condition} else {if_false})"
+        return condition
+
+    def parse_binary(self, level):
+        if level == len(self.BINARY_OPERATORS):
+            return self.parse_unary()
+        operators = self.BINARY_OPERATORS[level]
+        left = self.parse_binary(level + 1)
+        while self.peek() in operators:
+            operator = operators[self.next()]
+            right = self.parse_binary(level + 1)
+            left = f"({left} {operator} {right})"
+        return left
+
+    def parse_unary(self):
+        if self.peek() == '!':
+            self.next()
+            return f"(not {self.parse_unary()})"
+        if self.peek() in ('-', '+'):
+            return f"({self.next()}{self.parse_unary()})"
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.next()
+        if token == '(':
+            expression = self.parse_expression()
+            self.expect(')')
+            return expression
+        if token[0].isdigit():
+            return token
+        if token in ('true', 'false'):
+            return 'True' if token == 'true' else 'False'
+        if token in ('valueof', 'active'):
+            self.expect('(')
+            name = self.expect_name()
+            self.expect(')')
+            if token == 'valueof':
+                return self.compiler.resolve_value(name, self.where)
+            return self.compiler.resolve_active(name, self.where)
+        return self.compiler.resolve_name(token, self.where)
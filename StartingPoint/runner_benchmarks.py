@@ -0,0 +1,291 @@
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from difflib import ndiff
+
+from srcgen.lock_controller import LockController
+from srcgen.water_level_simulator import WaterLevelSimulator
+
+from lib.controller import Controller
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, YakinduTimingWheelTimerService, trace_output_events, use_event_deques
+from lib.ysc_interpreter import load_ysc
+from lib.test import record_output_trace, run_scenario, postprocess_trace, packed_environment_class
+from lib.diff import diff
+from lib.tracer import Tracer, AsyncEventPrinter
+from lib.trace_file import write_trace_file, read_trace_file, write_python_scenario, read_python_scenario
+from runner_tests import SCENARIOS, PlantState
+
+# Performance benchmarks for the run-time library.
+# Usage:
+#   python runner_benchmarks.py                 # run all benchmarks
+#   python runner_benchmarks.py timer_services  # run only the given benchmark(s)
+
+
+# Runs many LockController instances (each with a couple of concurrently running timers) on a single Controller.
+# Almost every timer expires, so YakinduTimingWheelTimerService is slower here than YakinduTimerServiceAdapter (see timer_churn for where it wins).
+def benchmark_timer_services(num_statecharts=2000, simulated_duration=10000000000):
+    def run(make_timer_service):
+        controller = Controller()
+        output_events = 0
+        def count_output_event(simtime, event_name, value):
+            nonlocal output_events
+            output_events += 1
+        shared_timer_service = make_timer_service(controller)
+        for i in range(num_statecharts):
+            sc = LockController()
+            trace_output_events(controller, sc, callback=count_output_event)
+            sc.timer_service = shared_timer_service or YakinduTimerServiceAdapter(controller)
+            sc.enter()
+        start = time.perf_counter()
+        controller.run_until(simulated_duration)
+        return output_events, time.perf_counter() - start
+
+    print(f"{num_statecharts} LockController instances, {simulated_duration/1000000000} s of simulated time")
+    for name, make_timer_service in [
+            ("YakinduTimerServiceAdapter (one per statechart)", lambda controller: None),
+            ("YakinduTimingWheelTimerService (shared)", YakinduTimingWheelTimerService),
+        ]:
+        output_events, duration = run(make_timer_service)
+        print(f"  {name}: {output_events} output events in {round(duration, 3)} s ({round(output_events/duration)} events/s)")
+
+
+# Receives time events, like a statechart would
+class TimeoutReceiver:
+    def time_elapsed(self, event_id):
+        pass
+
+# Many long-running timeouts that are re-armed (unset, and set again) much more often than they expire, like a statechart that re-enters a state with an 'after 30 s' timeout whenever an input event arrives.
+# This is where YakinduTimingWheelTimerService wins, from about 10^4 timers on: (un)setting a timer costs the same, no matter how many timers are running, whereas the event queue gets slower as it grows (and fills up with canceled entries).
+def benchmark_timer_churn(num_timers=(1000, 10000, 100000), num_rearms=300000):
+    print(f"{num_rearms} timer re-arms, simulated time advances 10 ms every 1000 re-arms")
+    for n in num_timers:
+        rand = random.Random(0)
+        rearms = [(rand.randrange(n), rand.randrange(30000, 60000)) for _ in range(num_rearms)]
+        durations = [rand.randrange(30000, 60000) for _ in range(n)]
+        for name, make_timer_service in [
+                ("YakinduTimerServiceAdapter (one per receiver)", lambda controller: None),
+                ("YakinduTimingWheelTimerService (shared)", YakinduTimingWheelTimerService),
+            ]:
+            controller = Controller()
+            shared_timer_service = make_timer_service(controller)
+            receivers = [(TimeoutReceiver(), shared_timer_service or YakinduTimerServiceAdapter(controller)) for _ in range(n)]
+            for (receiver, timer_service), duration in zip(receivers, durations):
+                timer_service.set_timer(receiver, 0, duration, False)
+            start = time.perf_counter()
+            for j, (i, duration) in enumerate(rearms):
+                receiver, timer_service = receivers[i]
+                timer_service.unset_timer(receiver, 0)
+                timer_service.set_timer(receiver, 0, duration, False)
+                if j % 1000 == 999:
+                    controller.run_until(controller.simulated_time + 10000000)
+            duration = time.perf_counter() - start
+            print(f"  {n} timers, {name}: {round(num_rearms/duration)} re-arms/s")
+
+
+# Loads (and runs) a long recorded input trace into a single LockController
+def benchmark_scenario_loading(num_events=100000):
+    input_trace = [(i * 100000000, "water_lvl", 500 + i % 1000) for i in range(num_events)]
+
+    def run(load):
+        controller = Controller()
+        sc = LockController()
+        sc.timer_service = YakinduTimerServiceAdapter(controller)
+        start = time.perf_counter()
+        load(controller, sc)
+        loaded = time.perf_counter()
+        sc.enter()
+        controller.run_until(input_trace[-1][0])
+        return loaded - start, time.perf_counter() - loaded
+
+    def load_one_by_one(controller, sc):
+        for (timestamp, event_name, value) in input_trace:
+            controller.add_input(sc, event_name, timestamp, value)
+
+    print(f"{num_events} input events")
+    for name, load in [
+            ("add_input (one by one)", load_one_by_one),
+            ("add_inputs (list)", lambda controller, sc: controller.add_inputs(sc, input_trace)),
+            ("add_inputs (generator)", lambda controller, sc: controller.add_inputs(sc, iter(input_trace))),
+        ]:
+        load_duration, run_duration = run(load)
+        print(f"  {name}: loaded in {round(load_duration, 3)} s, ran in {round(run_duration, 3)} s")
+
+
+# Runs many LockController instances, with the event queues generated by Yakindu (queue.Queue) and with EventDeques
+def benchmark_event_queues(num_statecharts=2000, simulated_duration=10000000000):
+    def run(make_event_queues):
+        controller = Controller()
+        timer_service = YakinduTimingWheelTimerService(controller)
+        output_events = 0
+        def count_output_event(simtime, event_name, value):
+            nonlocal output_events
+            output_events += 1
+        for i in range(num_statecharts):
+            sc = LockController()
+            make_event_queues(sc)
+            trace_output_events(controller, sc, callback=count_output_event)
+            sc.timer_service = timer_service
+            sc.enter()
+        start = time.perf_counter()
+        controller.run_until(simulated_duration)
+        return output_events, time.perf_counter() - start
+
+    print(f"{num_statecharts} LockController instances, {simulated_duration/1000000000} s of simulated time")
+    for name, make_event_queues in [
+            ("queue.Queue", lambda sc: None),
+            ("EventDeque", use_event_deques),
+            ("LockedEventDeque", lambda sc: use_event_deques(sc, thread_safe=True)),
+        ]:
+        output_events, duration = run(make_event_queues)
+        print(f"  {name}: {output_events} output events in {round(duration, 3)} s ({round(output_events/duration)} events/s)")
+
+
+# Runs many WaterLevelSimulator instances (of the given class) that are filling and draining, i.e., raising lots of events with parameter values
+def run_water_level_simulators(statechart_class, num_statecharts, simulated_duration):
+    controller = Controller()
+    timer_service = YakinduTimingWheelTimerService(controller)
+    output_events = 0
+    def count_output_event(simtime, event_name, value):
+        nonlocal output_events
+        output_events += 1
+    for i in range(num_statecharts):
+        sc = statechart_class()
+        use_event_deques(sc)
+        trace_output_events(controller, sc, callback=count_output_event)
+        sc.timer_service = timer_service
+        sc.enter()
+        controller.add_inputs(sc, [
+            (0, "open_flow", sc.HIGH), (4000000000, "close_flow", sc.HIGH),
+            (5000000000, "open_flow", sc.LOW), (9000000000, "close_flow", sc.LOW),
+        ])
+    start = time.perf_counter()
+    controller.run_until(simulated_duration)
+    return output_events, time.perf_counter() - start
+
+# Same WaterLevelSimulator workload, with the generated code and with the model loaded by the table-driven interpreter
+def benchmark_interpreter(num_statecharts=500, simulated_duration=10000000000):
+    print(f"{num_statecharts} WaterLevelSimulator instances, {simulated_duration/1000000000} s of simulated time")
+    for name, statechart_class in [
+            ("generated code", WaterLevelSimulator),
+            ("interpreted WaterLevelSimulator.ysc", load_ysc("WaterLevelSimulator.ysc")),
+        ]:
+        output_events, duration = run_water_level_simulators(statechart_class, num_statecharts, simulated_duration)
+        print(f"  {name}: {output_events} output events in {round(duration, 3)} s ({round(output_events/duration)} events/s)")
+
+
+# Diffs an output trace against one in which, halfway, all events start happening a bit later (so they all differ), like lib.test.check_output_trace does on failure
+def benchmark_trace_diff(num_events=200):
+    expected = [str((i * 50000000, "real_water_level", 500 + i % 1000)) for i in range(num_events)]
+    actual = expected[:num_events // 2] + [str((i * 50000000 + 1, "real_water_level", 500 + i % 1000)) for i in range(num_events // 2, num_events)]
+
+    print(f"{num_events} output events")
+    for name, compute_diff in [
+            ("difflib.ndiff", lambda: list(ndiff(expected, actual, charjunk=None))),
+            ("lib.diff.diff", lambda: diff(expected, actual)),
+        ]:
+        start = time.perf_counter()
+        compute_diff()
+        print(f"  {name}: {round(time.perf_counter() - start, 3)} s")
+
+
+# Runs a long LockController scenario whose expected output trace differs from the actual one early on, with and without stopping at the first difference
+def benchmark_stop_at_divergence(num_events=100000):
+    input_trace = [(i * 100000000, "water_lvl", 500 + i % 1000) for i in range(num_events)]
+    expected_output_trace = record_output_trace(input_trace, input_trace[-1][0], LockController)
+    timestamp, event_name, value = expected_output_trace[10]
+    expected_output_trace[10] = (timestamp + 1, event_name, value)
+
+    print(f"{num_events} input events, {len(expected_output_trace)} expected output events, differing at event 10")
+    for name, stop_at_divergence in [
+            ("run to completion, then compare", False),
+            ("stop_at_divergence", True),
+        ]:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = run_scenario(input_trace, expected_output_trace, LockController, PlantState, max_divergences=1, stop_at_divergence=stop_at_divergence)
+        print(f"  {name}: {'passed' if ok else 'failed'} in {round(time.perf_counter() - start, 3)} s")
+
+
+# Removes the events without effect from the expected output traces of the scenarios in runner_tests.py (as every test does, for both the expected and the actual trace), with both environment state protocols
+def benchmark_environment_state(repetitions=2000):
+    output_traces = [scenario["output_events"] for scenario in SCENARIOS]
+    num_events = sum(len(output_trace) for output_trace in output_traces) * repetitions
+
+    print(f"runner_tests.SCENARIOS, {repetitions} times, {num_events} output events")
+    for name, environment_class in [
+            ("PlantState (AbstractEnvironmentState, dataclasses.replace)", PlantState),
+            ("packed_environment_class(PlantState)", packed_environment_class(PlantState)),
+        ]:
+        start = time.perf_counter()
+        for i in range(repetitions):
+            for output_trace in output_traces:
+                postprocess_trace(output_trace, environment_class)
+        duration = time.perf_counter() - start
+        print(f"  {name}: {round(duration, 3)} s ({round(num_events/duration)} events/s)")
+
+
+# Writes a long recorded session to a file, and loads it again, as a Python literal scenario and as a trace file
+def benchmark_trace_file(num_events=200000):
+    input_events = [(i * 100000000, "water_lvl", 500 + i % 1000) for i in range(num_events // 2)]
+    output_events = [(i * 100000000, "set_request_pending", i % 2 == 0) for i in range(num_events // 2)]
+    scenario = {"name": "long session", "input_events": input_events, "output_events": output_events}
+
+    print(f"{num_events} events")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, write, read, path in [
+                ("Python literal", write_python_scenario, read_python_scenario, os.path.join(directory, "session.py")),
+                ("trace file", lambda path, scenario: write_trace_file(path, scenario["name"], scenario["input_events"], scenario["output_events"]), read_trace_file, os.path.join(directory, "session.trace")),
+            ]:
+            start = time.perf_counter()
+            write(path, scenario)
+            written = time.perf_counter()
+            assert read(path) == scenario
+            print(f"  {name}: {os.path.getsize(path)} bytes, written in {round(written - start, 3)} s, read in {round(time.perf_counter() - written, 3)} s")
+
+
+# Records events with a verbose Tracer (as runner_gui.py does), that prints them right away, and with an AsyncEventPrinter, and measures how long the simulation thread spends per event.
+# Output goes to os.devnull, so this only shows the cost of formatting and writing, a terminal is a lot slower.
+def benchmark_verbose_tracing(num_events=200000):
+    def run(printer, stream):
+        tracer = Tracer(verbose=True, printer=printer)
+        record_output_event = tracer.record_output_event
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(stream):
+            for i in range(num_events):
+                record_output_event(i * 100000000, "real_water_level", 500 + i % 1000)
+            recorded = time.perf_counter()
+            if printer is not None:
+                printer.close()
+        return recorded - start, time.perf_counter() - start
+
+    print(f"{num_events} output events")
+    with open(os.devnull, "w") as stream:
+        for name, make_printer in [
+                ("print", lambda: None),
+                ("AsyncEventPrinter", lambda: AsyncEventPrinter(stream)),
+            ]:
+            record_duration, total_duration = run(make_printer(), stream)
+            print(f"  {name}: {round(record_duration / num_events * 1000000000)} ns per event in the simulation thread, {round(total_duration, 3)} s until everything was written")
+
+BENCHMARKS = {
+    "timer_services": benchmark_timer_services,
+    "timer_churn": benchmark_timer_churn,
+    "scenario_loading": benchmark_scenario_loading,
+    "event_queues": benchmark_event_queues,
+    "interpreter": benchmark_interpreter,
+    "trace_diff": benchmark_trace_diff,
+    "stop_at_divergence": benchmark_stop_at_divergence,
+    "environment_state": benchmark_environment_state,
+    "trace_file": benchmark_trace_file,
+    "verbose_tracing": benchmark_verbose_tracing,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS.keys():
+        print(f"Running benchmark: {name}")
+        BENCHMARKS[name]()
+        print("--------")
@@ -9,11 +9,13 @@ from srcgen.lock_controller import LockController
 
 from lib.yakindu.rx import Observer
 from lib.controller import Controller, pretty_time
-from lib.tracer import Tracer, format_trace_as_python_code
+from lib.tracer import RingBufferTracer, AsyncEventPrinter, format_trace_as_python_code
+from lib.trace_file import TraceWriter
 from lib.yakindu_helpers import YakinduTimerServiceAdapter, CallbackObserver, trace_output_events
 from lib.realtime.realtime import WallClock
 from lib.realtime.event_loop import EventLoopRealTimeSimulation
 from lib.realtime.tk_event_loop import TkEventLoopAdapter
+from lib.realtime.instrumentation import RealTimeStats
 
 from gui import GUI
 
@@ -26,6 +28,9 @@ if __name__ == "__main__":
         time_scale = 1.0
     print(f"TIME SCALE is {time_scale}")
 
+    # optionally, also record the session in a (binary) trace file, see lib/trace_file.py
+    trace_file_path = sys.argv[2] if len(sys.argv) > 2 else None
+
 
     sc = LockController()
     wlvlsc = WaterLevelSimulator() # our environment is also modeled as a statechart :)
@@ -33,8 +38,12 @@ if __name__ == "__main__":
     controller = Controller()
 
     # We'll record input and output events
-    tracer = Tracer()
-    controller.input_tracers.append((sc, tracer.record_input_event))
+    # Only the last events are kept in memory, older ones go to the trace file (if any)
+    trace_writer = TraceWriter(trace_file_path, name="interactive") if trace_file_path is not None else None
+    # Events are printed from a background thread, not to slow down the simulation
+    printer = AsyncEventPrinter()
+    tracer = RingBufferTracer(capacity=100000, spill_writer=trace_writer, printer=printer)
+    controller.register_input_tracer(sc, tracer.record_input_event)
     trace_output_events(controller, sc, callback=tracer.record_output_event)
 
     sc.timer_service = YakinduTimerServiceAdapter(controller)
@@ -43,7 +52,9 @@ if __name__ == "__main__":
     toplevel = tkinter.Tk()
 
     wall_clock = WallClock(time_scale)
-    sim = EventLoopRealTimeSimulation(controller, TkEventLoopAdapter(toplevel), wall_clock)
+    # measures how well the simulation keeps up with the wall clock (printed at the end), to choose a time scale for your machine
+    stats = RealTimeStats()
+    sim = EventLoopRealTimeSimulation(controller, TkEventLoopAdapter(toplevel), wall_clock, stats=stats)
 
     gui = GUI(sim, sc, wlvlsc, toplevel)
 
@@ -64,7 +75,12 @@ if __name__ == "__main__":
     wlvlsc.real_water_level_observable.subscribe(CallbackObserver(gui.on_real_water_level))
 
     def print_trace_on_exit():
-        print("End of simulation. Full I/O trace:")
+        printer.close() # print the remaining events first
+        print(stats.report())
+        if tracer.is_truncated():
+            print(f"End of simulation. I/O trace of the last {tracer.input_events.capacity} input and output events (earlier events were not kept in memory):")
+        else:
+            print("End of simulation. Full I/O trace:")
         print("{")
         print('    "name": "interactive",')
         print('    "input_events": ', end='')
@@ -72,6 +88,7 @@ if __name__ == "__main__":
         print('    "output_events": ', end='')
         print(format_trace_as_python_code(tracer.output_events, indent=4))
         print("}")
+        tracer.close() # writes the rest of the trace file
     atexit.register(print_trace_on_exit)
 
     wall_clock.record_start_time() # start_time is NOW!
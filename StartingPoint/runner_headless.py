@@ -0,0 +1,89 @@
+import collections
+import random
+import sys
+import time
+
+from srcgen.water_level_simulator import WaterLevelSimulator
+from srcgen.lock_controller import LockController
+# from srcgen.solution import Solution as LockController # Teacher's solution
+
+from lib.controller import Controller, pretty_time
+from lib.event_bus import EventBus
+from lib.tracer import Tracer
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, trace_output_events, use_event_deques
+
+# Runs LockController and WaterLevelSimulator in a closed loop, like runner_gui.py does, but without GUI, as fast as possible, e.g., for soak tests, or to see what happens with other inputs.
+# Usage:
+#   python runner_headless.py                  # 1 hour of simulated time, a water level change requested every 60 s
+#   python runner_headless.py 86400 30 42      # 1 day, a request every 30 s, random seed 42 for the sensor noise
+
+# Connects the statecharts in the same way as gui.GUI does:
+#   open_flow/close_flow of LockController -> open_flow/close_flow of WaterLevelSimulator
+#   sensor_reading of WaterLevelSimulator -> water_lvl of LockController, with the same (seeded) noise
+def connect(bus, sc, wlvlsc, randomseed=0):
+    bus.connect(sc, "open_flow", wlvlsc, "open_flow")
+    bus.connect(sc, "close_flow", wlvlsc, "close_flow")
+    bus.connect(wlvlsc, "sensor_reading", sc, "water_lvl", transform=SensorNoise(randomseed))
+
+# The measured water level - can be nonsense if sensor is broken
+# (a class rather than a closure, so that it can be sent to another process, see runner_parallel.py)
+class SensorNoise:
+    def __init__(self, randomseed=0):
+        self.rand = random.Random(randomseed) # seed
+
+    def __call__(self, water_level):
+        return int(water_level + self.rand.random()*10)
+
+# Runs the closed loop until 'until' (simulated time), with the given input events (instead of the GUI's buttons) for LockController (e.g., "request_lvl_change") and for WaterLevelSimulator (e.g., "toggle_sensor_broken").
+# Returns a Tracer with the I/O trace of LockController (as recorded by runner_gui.py), and the number of events that occurred (input events, including timers, and output events, of both statecharts).
+def run_closed_loop(until, lock_inputs=(), water_level_inputs=(), randomseed=0):
+    controller = Controller()
+    sc = LockController()
+    wlvlsc = WaterLevelSimulator()
+    use_event_deques(sc)
+    use_event_deques(wlvlsc)
+
+    tracer = Tracer(verbose=False)
+    controller.register_input_tracer(sc, tracer.record_input_event)
+    trace_output_events(controller, sc, callback=tracer.record_output_event)
+
+    num_events = 0
+    def count_event(simtime, event_name, value):
+        nonlocal num_events
+        num_events += 1
+    for statechart in (sc, wlvlsc):
+        controller.register_input_tracer(statechart, count_event)
+        trace_output_events(controller, statechart, callback=count_event)
+
+    sc.timer_service = YakinduTimerServiceAdapter(controller)
+    wlvlsc.timer_service = YakinduTimerServiceAdapter(controller)
+
+    connect(EventBus(controller), sc, wlvlsc, randomseed)
+
+    controller.add_inputs(sc, lock_inputs)
+    controller.add_inputs(wlvlsc, water_level_inputs)
+
+    sc.enter()
+    wlvlsc.enter()
+
+    controller.run_until(until)
+    return tracer, num_events
+
+if __name__ == "__main__":
+    # read simulated duration (s), interval between water level change requests (s) and random seed from command line
+    args = sys.argv[1:] + [None] * 3
+    duration = int(float(args[0] or 3600) * 1000000000)
+    request_interval = int(float(args[1] or 60) * 1000000000)
+    randomseed = int(args[2] or 0)
+
+    lock_inputs = ((timestamp, "request_lvl_change", None) for timestamp in range(request_interval, duration + 1, request_interval))
+
+    start = time.perf_counter()
+    tracer, num_events = run_closed_loop(duration, lock_inputs, randomseed=randomseed)
+    wall_time = time.perf_counter() - start
+
+    print(f"Simulated {pretty_time(duration)} in {wall_time:.3f} s ({duration / 1000000000 / wall_time:.0f}x real time)")
+    print(f"{num_events} events, {num_events / wall_time:.0f} events/s, {num_events / (duration / 1000000000):.1f} events per simulated second")
+    print(f"LockController: {len(tracer.input_events)} input events, {len(tracer.output_events)} output events:")
+    for event_name, count in sorted(collections.Counter(event_name for (_, event_name, _) in tracer.output_events).items()):
+        print(f"  {event_name}: {count}")
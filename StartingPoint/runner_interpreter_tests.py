@@ -0,0 +1,113 @@
+import random
+
+from srcgen import a, b, c, d, e
+from srcgen.lock_controller import LockController
+from srcgen.water_level_simulator import WaterLevelSimulator
+
+from lib.test import record_output_trace
+from lib.ysc_interpreter import load_ysc
+from runner_tests import SCENARIOS as LOCK_CONTROLLER_SCENARIOS
+
+# Checks that the classes that lib.ysc_interpreter.load_ysc loads from the models behave exactly like the classes generated from the same models (in srcgen/), i.e., record the same output traces for the same input traces.
+# Run this after changing (and re-generating) a model, to see whether the interpreter supports it.
+
+def make_random_lock_controller_scenarios(num_scenarios, seed=0):
+    rand = random.Random(seed)
+    scenarios = []
+    for i in range(num_scenarios):
+        events = [("request_lvl_change", None), ("resume", None), ("door_obstructed", None)] + [("water_lvl", level) for level in range(0, 2000, 50)]
+        input_events = sorted(
+            (rand.randrange(0, 60000000000, rand.choice([1, 50000000, 100000000])), event_name, value)
+            for event_name, value in rand.choices(events, k=rand.randrange(40))
+        )
+        scenarios.append({"name": f"random {i}", "input_events": input_events, "until": rand.randrange(80000000000)})
+    return scenarios
+
+FLOW_LOW, FLOW_HIGH = 0, 1 # the LOW and HIGH flows of WaterLevelSimulator
+
+def make_random_water_level_scenarios(num_scenarios, seed=0):
+    rand = random.Random(seed)
+    scenarios = []
+    for i in range(num_scenarios):
+        events = [("open_flow", FLOW_LOW), ("open_flow", FLOW_HIGH), ("close_flow", FLOW_LOW), ("close_flow", FLOW_HIGH), ("toggle_sensor_broken", None)]
+        input_events = sorted(
+            (rand.randrange(0, 60000000000, rand.choice([1, 50000000, 100000000])), event_name, value)
+            for event_name, value in rand.choices(events, k=rand.randrange(20))
+        )
+        scenarios.append({"name": f"random {i}", "input_events": input_events, "until": rand.randrange(80000000000)})
+    return scenarios
+
+WATER_LEVEL_SCENARIOS = [
+{
+    "name": "fill",
+    "input_events": [
+        (1000000000, "open_flow", FLOW_HIGH),
+    ],
+    "until": 10000000000,
+},
+{
+    "name": "fill, then drain",
+    "input_events": [
+        (0, "open_flow", FLOW_HIGH),
+        (5000000000, "close_flow", FLOW_HIGH),
+        (6000000000, "open_flow", FLOW_LOW),
+        (12000000000, "close_flow", FLOW_LOW),
+    ],
+    "until": 15000000000,
+},
+{
+    "name": "both flows open, for a long time",
+    "input_events": [
+        (0, "open_flow", FLOW_HIGH),
+        (1050000000, "open_flow", FLOW_LOW),
+    ],
+    "until": 600000000000,
+},
+{
+    "name": "both flows open, timers at the same time",
+    "input_events": [
+        (0, "open_flow", FLOW_HIGH),
+        (1000000000, "open_flow", FLOW_LOW),
+        (300000000000, "toggle_sensor_broken", None),
+        (400000000000, "close_flow", FLOW_HIGH),
+        (400000000000, "toggle_sensor_broken", None),
+    ],
+    "until": 500000000000,
+},
+]
+
+
+EXERCISE_SCENARIOS = [{"name": "no input", "input_events": [], "until": 20000000000}]
+
+MODELS = [
+    ("LockController.ysc", LockController, [
+        {"name": s["name"], "input_events": s["input_events"], "until": s["output_events"][-1][0]}
+        for s in LOCK_CONTROLLER_SCENARIOS
+    ] + make_random_lock_controller_scenarios(50)),
+    ("WaterLevelSimulator.ysc", WaterLevelSimulator, WATER_LEVEL_SCENARIOS + make_random_water_level_scenarios(50)),
+    ("exercises/A.ysc", a.A, EXERCISE_SCENARIOS),
+    ("exercises/B.ysc", b.B, EXERCISE_SCENARIOS),
+    ("exercises/C.ysc", c.C, EXERCISE_SCENARIOS),
+    ("exercises/D.ysc", d.D, EXERCISE_SCENARIOS),
+    ("exercises/E.ysc", e.E, EXERCISE_SCENARIOS),
+]
+
+if __name__ == "__main__":
+    ok = True
+    for path, generated_class, scenarios in MODELS:
+        interpreted_class = load_ysc(path)
+        for scenario in scenarios:
+            print(f"Running scenario: {path}, {scenario['name']}")
+            expected = record_output_trace(scenario["input_events"], scenario["until"], generated_class)
+            actual = record_output_trace(scenario["input_events"], scenario["until"], interpreted_class)
+            if actual == expected:
+                print(f"Traces match ({len(expected)} output events).")
+            else:
+                ok = False
+                first_difference = next((i for i, (x, y) in enumerate(zip(actual, expected)) if x != y), min(len(actual), len(expected)))
+                print(f"Traces differ from output event {first_difference} on!")
+            print("--------")
+    if ok:
+        print("All scenarios passed.")
+    else:
+        print("Some scenarios failed.")
@@ -0,0 +1,87 @@
+import sys
+import time
+
+from srcgen.water_level_simulator import WaterLevelSimulator
+from srcgen.lock_controller import LockController
+# from srcgen.solution import Solution as LockController # Teacher's solution
+
+from lib.controller import pretty_time
+from lib.parallel import CoSimulation, shortest_timer
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, use_event_deques
+from runner_headless import SensorNoise
+
+# Co-simulates a chain of locks, each with its own WaterLevelSimulator (connected like in runner_gui.py), with every statechart in a process of its own (see lib/parallel.py).
+# Boats arrive at the first lock at regular intervals. Every time a lock changes its 'request pending' light, a boat arrives at the next lock, some time later.
+# Checks that the I/O traces of all statecharts are identical to those of a single-process run.
+# Usage:
+#   python runner_parallel.py              # 1 hour of simulated time, 4 locks
+#   python runner_parallel.py 86400 8      # 1 day, 8 locks
+
+BOAT_TRAVEL_TIME = 30000000000 # 30 s, between two locks
+REQUEST_INTERVAL = 60000000000 # 60 s, between boats arriving at the first lock
+
+def build_lock(controller, name, inputs):
+    sc = LockController()
+    use_event_deques(sc)
+    sc.timer_service = YakinduTimerServiceAdapter(controller)
+    controller.add_inputs(sc, inputs)
+    return {name: sc}
+
+def build_water_level_simulator(controller, name):
+    wlvlsc = WaterLevelSimulator()
+    use_event_deques(wlvlsc)
+    wlvlsc.timer_service = YakinduTimerServiceAdapter(controller)
+    return {name: wlvlsc}
+
+# request_lvl_change has no parameter
+def drop_value(value):
+    return None
+
+def make_cosimulation(duration, num_locks):
+    cosim = CoSimulation()
+    boats = [(timestamp, "request_lvl_change", None) for timestamp in range(REQUEST_INTERVAL, duration + 1, REQUEST_INTERVAL)]
+    for i in range(num_locks):
+        cosim.add_process(f"lock{i}", [f"lock{i}"], build_lock, args=(f"lock{i}", boats if i == 0 else []))
+        # the WaterLevelSimulator only raises output events when its timers expire (or when its sensor breaks, which is not caused by another process)
+        cosim.add_process(f"wlvl{i}", [f"wlvl{i}"], build_water_level_simulator, args=(f"wlvl{i}",), lookahead=shortest_timer(WaterLevelSimulator))
+    for i in range(num_locks):
+        cosim.connect(f"lock{i}", "open_flow", f"wlvl{i}", "open_flow")
+        cosim.connect(f"lock{i}", "close_flow", f"wlvl{i}", "close_flow")
+        cosim.connect(f"wlvl{i}", "sensor_reading", f"lock{i}", "water_lvl", transform=SensorNoise(randomseed=i))
+        if i + 1 < num_locks:
+            cosim.connect(f"lock{i}", "set_request_pending", f"lock{i+1}", "request_lvl_change", transform=drop_value, delay=BOAT_TRAVEL_TIME)
+    return cosim
+
+if __name__ == "__main__":
+    # read simulated duration (s) and number of locks from command line
+    args = sys.argv[1:] + [None] * 2
+    duration = int(float(args[0] or 3600) * 1000000000)
+    num_locks = int(args[1] or 4)
+
+    cosim = make_cosimulation(duration, num_locks)
+
+    start = time.perf_counter()
+    expected = cosim.run_sequential(duration)
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = cosim.run_parallel(duration)
+    parallel_time = time.perf_counter() - start
+
+    num_events = sum(len(scenario["input_events"]) + len(scenario["output_events"]) for scenario in expected.values())
+    print(f"Simulated {pretty_time(duration)} of {num_locks} locks ({num_events} traced events):")
+    print(f"  single process:           {sequential_time:.3f} s")
+    print(f"  {len(cosim.processes)} processes:              {parallel_time:.3f} s")
+
+    ok = True
+    for sc_name, scenario in expected.items():
+        for trace in ("input_events", "output_events"):
+            if actual[sc_name][trace] != scenario[trace]:
+                ok = False
+                first_difference = next((i for i, (a, b) in enumerate(zip(actual[sc_name][trace], scenario[trace])) if a != b), min(len(actual[sc_name][trace]), len(scenario[trace])))
+                print(f"{sc_name}: {trace} differ from event {first_difference} on")
+
+    if ok:
+        print("All scenarios passed.")
+    else:
+        print("Some scenarios failed.")
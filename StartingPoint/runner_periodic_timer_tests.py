@@ -0,0 +1,173 @@
+import os
+import tempfile
+
+from srcgen.a import A
+from srcgen.lock_controller import LockController
+
+from lib.controller import Controller
+from lib.tracer import Tracer
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, YakinduTimingWheelTimerService, trace_output_events, use_event_deques
+from lib.ysc_interpreter import load_ysc
+
+# Checks that periodic timers (set_timer(..., periodic=True)) produce exactly the same traces as one-shot timers that are re-armed every time they fire, with both timer services.
+# The generated code only uses one-shot timers, so the periodic timers are introduced by PeriodicRings (see below), for:
+#   - exercise A, where a self-transition re-enters its state (and re-arms its timer) every second
+#   - the blink regions of LockController, where every state moves on to the next state of its region after a fixed time
+# Also, exercise A is loaded (with lib.ysc_interpreter) from a copy of its model where the self-transition is triggered by 'every 1s' instead of 'after 1s', so that the statechart itself sets periodic timers, and cancels them while they fire.
+# Every scenario also exits the statechart (canceling all of its timers, periodic or not) and enters it again, at and in between timer expirations.
+
+# A ring is a group of states (given by the event ids of their timers) of which exactly one is active, and where every state moves on to the next one (or to itself) after the same fixed time.
+# PeriodicRings sits between a statechart and its timer service, and runs every ring with one periodic timer, like an 'every'-trigger would, instead of one one-shot timer per state that is re-armed on every state change.
+# The other timers are passed through.
+class PeriodicRings:
+    def __init__(self, timer_service, rings):
+        self.timer_service = timer_service
+        self.ring_of = {event_id: ring for ring in rings for event_id in ring}
+        self.ring_timers = {} # (sc, ring) -> RingTimer
+        self.num_rearms_avoided = 0
+
+    def set_timer(self, sc, event_id, duration, periodic):
+        ring = self.ring_of.get(event_id)
+        if ring is None:
+            self.timer_service.set_timer(sc, event_id, duration, periodic)
+            return
+        ring_timer = self.ring_timers.get((sc, ring))
+        if ring_timer is None:
+            # the timer service knows it by the event id of the first state of the ring
+            ring_timer = self.ring_timers[(sc, ring)] = RingTimer(sc, self.timer_service, ring[0])
+        ring_timer.event_id = event_id
+        if ring_timer.leaving:
+            # state change within the ring: the periodic timer keeps running
+            ring_timer.leaving = False
+            self.num_rearms_avoided += 1
+        else:
+            self.timer_service.set_timer(ring_timer, ring_timer.timer_id, duration, True)
+
+    def unset_timer(self, sc, event_id):
+        ring = self.ring_of.get(event_id)
+        if ring is None:
+            self.timer_service.unset_timer(sc, event_id)
+            return
+        ring_timer = self.ring_timers.get((sc, ring))
+        if ring_timer is None or ring_timer.event_id != event_id:
+            return # not running
+        if ring_timer.firing:
+            # whether the ring is left, or another state of the ring is entered, is known once the time event has been handled
+            ring_timer.leaving = True
+        else:
+            ring_timer.stop()
+
+# The periodic timer of a ring: every time it fires, it raises the time event of the active state of the ring
+class RingTimer:
+    def __init__(self, sc, timer_service, timer_id):
+        self.sc = sc
+        self.timer_service = timer_service
+        self.timer_id = timer_id
+        self.event_id = None # of the active state, or None if the timer is not running
+        self.firing = False
+        self.leaving = False
+
+    def time_elapsed(self, timer_id):
+        self.firing = True
+        self.sc.time_elapsed(self.event_id)
+        self.firing = False
+        if self.leaving:
+            self.leaving = False
+            self.stop()
+
+    def stop(self):
+        self.event_id = None
+        self.timer_service.unset_timer(self, self.timer_id)
+
+# Exercise A, with 'every 1s' instead of 'after 1s'
+def load_every_a():
+    with open("exercises/A.ysc") as f:
+        model = f.read()
+    assert "after 1s / raise x" in model
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "A_every.ysc")
+        with open(path, "w") as f:
+            f.write(model.replace("after 1s / raise x", "every 1s / raise x"))
+        return load_ysc(path)
+
+SCENARIOS = [
+    {
+        "name": "exercise A",
+        "statechart_class": A,
+        "rings": [(0,)],
+        "enter_exit": [(4500000000, "exit"), (6000000000, "enter"), (8000000000, "exit"), (8000000000, "enter"), (9500000000, "exit")],
+        "until": 12000000000,
+    },
+    {
+        "name": "exercise A, 'every 1s'",
+        "statechart_class": A,
+        "periodic_class": load_every_a(),
+        "enter_exit": [(4500000000, "exit"), (6000000000, "enter"), (8000000000, "exit"), (8000000000, "enter"), (9500000000, "exit")],
+        "until": 12000000000,
+    },
+    {
+        "name": "LockController blink regions",
+        "statechart_class": LockController,
+        "rings": [(0, 1), (2, 3, 4, 5), (6, 7)],
+        "enter_exit": [(3250000000, "exit"), (4000000000, "enter"), (7500000000, "exit"), (7600000000, "enter"), (21000000000, "exit")],
+        "until": 25000000000,
+    },
+]
+
+TIMER_SERVICES = [
+    ("YakinduTimerServiceAdapter", lambda controller, shared: YakinduTimerServiceAdapter(controller)),
+    ("YakinduTimingWheelTimerService", lambda controller, shared: shared),
+]
+
+# Runs two instances of the statechart on one Controller (so that their timers are interleaved), and returns their (input and output) traces
+def run(scenario, make_timer_service, periodic):
+    controller = Controller()
+    shared_timer_service = YakinduTimingWheelTimerService(controller)
+    traces = []
+    periodic_rings = []
+    statechart_class = scenario["periodic_class"] if periodic and "periodic_class" in scenario else scenario["statechart_class"]
+    for i in range(2):
+        sc = statechart_class()
+        use_event_deques(sc)
+        tracer = Tracer(verbose=False)
+        controller.register_input_tracer(sc, tracer.record_input_event)
+        trace_output_events(controller, sc, callback=tracer.record_output_event)
+        sc.timer_service = make_timer_service(controller, shared_timer_service)
+        if periodic and "rings" in scenario:
+            sc.timer_service = PeriodicRings(sc.timer_service, scenario["rings"])
+            periodic_rings.append(sc.timer_service)
+        for timestamp, method in scenario["enter_exit"]:
+            controller.add_input_lowlevel(timestamp + i * 125000000, getattr(sc, method), None, method, sc)
+        sc.enter()
+        traces.append(tracer)
+    controller.run_until(scenario["until"])
+    # every statechart has been exited, so all timers must have been canceled:
+    timers_left = controller.have_event()
+    num_rearms_avoided = sum(p.num_rearms_avoided for p in periodic_rings)
+    return [(tracer.input_events, tracer.output_events) for tracer in traces], timers_left, num_rearms_avoided
+
+if __name__ == "__main__":
+    ok = True
+    for scenario in SCENARIOS:
+        for timer_service_name, make_timer_service in TIMER_SERVICES:
+            print(f"Running scenario: {scenario['name']}, {timer_service_name}")
+            expected, expected_timers_left, _ = run(scenario, make_timer_service, periodic=False)
+            actual, timers_left, num_rearms_avoided = run(scenario, make_timer_service, periodic=True)
+            scenario_ok = True
+            if actual != expected:
+                print("Traces differ!")
+                scenario_ok = False
+            if timers_left or expected_timers_left:
+                print("Timers left after exiting the statecharts!")
+                scenario_ok = False
+            if "rings" in scenario and num_rearms_avoided == 0:
+                print("No periodic timer fired!")
+                scenario_ok = False
+            if scenario_ok:
+                print(f"Traces match ({sum(len(output_events) for (_, output_events) in expected)} output events, {num_rearms_avoided} re-arms avoided).")
+            ok = ok and scenario_ok
+            print("--------")
+    if ok:
+        print("All scenarios passed.")
+    else:
+        print("Some scenarios failed.")
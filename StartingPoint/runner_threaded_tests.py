@@ -0,0 +1,129 @@
+import random
+import sys
+import threading
+import time
+
+from srcgen.water_level_simulator import WaterLevelSimulator
+from srcgen.lock_controller import LockController
+
+from lib.controller import Controller
+from lib.event_bus import EventBus
+from lib.realtime.realtime import WallClock
+from lib.realtime.threaded import RealTimeWorker, ThreadedRealTimeSimulation
+from lib.yakindu_helpers import YakinduTimerServiceAdapter, use_event_deques
+from runner_headless import connect
+
+# Stress test for lib/realtime/threaded.py: one RealTimeWorker thread drives many closed-loop simulations (LockController + WaterLevelSimulator, like runner_gui.py), while several producer threads inject input events into them, as fast as they can.
+# Checks that every injected event occurs exactly once, in the order in which its producer injected it, and that simulated time never goes back.
+# Usage:
+#   python runner_threaded_tests.py              # 8 simulations, 4 producers, 5000 events per producer
+#   python runner_threaded_tests.py 32 8 20000
+
+# Receives the injected events (besides the LockController, which also receives some of them)
+class Sink:
+    def __init__(self):
+        self.received = [] # (producer, sequence number)-tuples
+
+    def raise_injected(self, value):
+        self.received.append(value)
+
+def make_simulation(worker, time_scale):
+    controller = Controller()
+    sc = LockController()
+    wlvlsc = WaterLevelSimulator()
+    # only the worker thread raises events on the statecharts
+    use_event_deques(sc)
+    use_event_deques(wlvlsc)
+    sc.timer_service = YakinduTimerServiceAdapter(controller)
+    wlvlsc.timer_service = YakinduTimerServiceAdapter(controller)
+    connect(EventBus(controller), sc, wlvlsc)
+    sink = Sink()
+
+    time_went_back = False
+    def check_time(simtime, event_name, value):
+        nonlocal time_went_back
+        if simtime < controller.simulated_time:
+            time_went_back = True
+    for target in (sc, wlvlsc, sink):
+        controller.register_input_tracer(target, check_time)
+
+    wall_clock = WallClock(time_scale)
+    wall_clock.record_start_time()
+    sc.enter()
+    wlvlsc.enter()
+    sim = ThreadedRealTimeSimulation(controller, wall_clock, worker=worker)
+    return sim, sc, sink, lambda: time_went_back
+
+def produce(producer, sims, num_events, failures):
+    rand = random.Random(producer)
+    try:
+        for seq in range(num_events):
+            sim, sc, sink, _ = rand.choice(sims)
+            sim.add_input_now(sink, "injected", (producer, seq))
+            if seq % 100 == 0:
+                sim.add_input_now(sc, "request_lvl_change")
+                time.sleep(0) # let the other threads run
+    except Exception as e:
+        failures.append(e)
+
+if __name__ == "__main__":
+    args = sys.argv[1:] + [None] * 3
+    num_simulations = int(args[0] or 8)
+    num_producers = int(args[1] or 4)
+    num_events = int(args[2] or 5000)
+
+    worker = RealTimeWorker()
+    sims = [make_simulation(worker, time_scale=1.0) for _ in range(num_simulations)]
+
+    worker_failures = []
+    def run_worker():
+        try:
+            worker.mainloop()
+        except Exception as e:
+            worker_failures.append(e)
+    worker_thread = threading.Thread(target=run_worker)
+    worker_thread.start()
+
+    producer_failures = []
+    start = time.perf_counter()
+    producers = [threading.Thread(target=produce, args=(producer, sims, num_events, producer_failures)) for producer in range(num_producers)]
+    for thread in producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+
+    # wait until the worker has handled all injected events
+    total = num_producers * num_events
+    deadline = time.perf_counter() + 10
+    while sum(len(sink.received) for (_, _, sink, _) in sims) < total and time.perf_counter() < deadline and worker_thread.is_alive():
+        time.sleep(0.01)
+    wall_time = time.perf_counter() - start
+    worker.stop()
+    worker_thread.join()
+
+    ok = True
+    def fail(message):
+        global ok
+        ok = False
+        print(message)
+
+    print(f"Injected {total} events from {num_producers} threads into {num_simulations} simulations, handled in {wall_time:.3f} s")
+    for e in producer_failures + worker_failures:
+        fail(f"Exception: {e!r}")
+    received = [event for (_, _, sink, _) in sims for event in sink.received]
+    if len(received) != total or len(set(received)) != total:
+        fail(f"Expected {total} distinct events, received {len(received)} ({len(set(received))} distinct)")
+    for i, (_, _, sink, time_went_back) in enumerate(sims):
+        last_seq = {}
+        for producer, seq in sink.received:
+            if seq <= last_seq.get(producer, -1):
+                fail(f"Simulation {i}: events of producer {producer} out of order")
+                break
+            last_seq[producer] = seq
+        if time_went_back():
+            fail(f"Simulation {i}: simulated time went back")
+
+    if ok:
+        print("All scenarios passed.")
+    else:
+        print("Some scenarios failed.")
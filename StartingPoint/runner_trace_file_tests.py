@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+from lib.trace_file import TraceReader, TraceWriter, INPUT, OUTPUT, write_trace_file, read_trace_file
+from runner_tests import SCENARIOS
+
+# Checks that lib/trace_file.py reads back exactly the traces that were written, and that a TraceReader can be closed while its traces are still referenced.
+
+# Events with every type of value, spread over many (small) blocks
+MIXED_EVENTS = [(i * 1000, f"event{i % 7}", [None, True, False, i, -i * 3, i / 3, f"s{i % 5}", ""][i % 8]) for i in range(1000)]
+
+def check_round_trip(path, scenario, block_size):
+    with TraceWriter(path, scenario["name"], block_size=block_size) as writer:
+        writer.add_events(INPUT, scenario["input_events"])
+        writer.add_events(OUTPUT, scenario["output_events"])
+    ok = read_trace_file(path) == scenario
+    with TraceReader(path) as reader:
+        for trace in ("input_events", "output_events"):
+            view = getattr(reader, trace)
+            expected = scenario[trace]
+            ok = ok and len(view) == len(expected)
+            ok = ok and all(view[i] == expected[i] for i in range(-len(expected), len(expected)))
+            ok = ok and list(view.iter_timestamps()) == [timestamp for (timestamp, _, _) in expected]
+    return ok
+
+# Keeps the views of a reader (and an iterator over one of them), and closes the reader
+def check_close_with_views(path, scenario):
+    write_trace_file(path, scenario["name"], scenario["input_events"], scenario["output_events"])
+    with TraceReader(path) as reader:
+        input_events = reader.input_events
+        output_events = reader.output_events
+        iterator = iter(output_events)
+        next(iterator, None)
+    ok = len(input_events) == len(scenario["input_events"])
+    for access in (lambda: input_events[0], lambda: list(output_events), lambda: list(input_events.iter_timestamps())):
+        try:
+            access()
+            ok = False # should have raised
+        except ValueError:
+            pass
+    reader.close() # closing twice has no effect
+    return ok
+
+if __name__ == "__main__":
+    ok = True
+    scenarios = SCENARIOS + [{"name": "mixed values", "input_events": MIXED_EVENTS, "output_events": MIXED_EVENTS[::-1]}]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.trace")
+        for scenario in scenarios:
+            print(f"Running scenario: {scenario['name']}")
+            scenario_ok = True
+            for block_size in (1, 7, 65536):
+                if not check_round_trip(path, scenario, block_size):
+                    print(f"Traces differ (block size {block_size})!")
+                    scenario_ok = False
+            if not check_close_with_views(path, scenario):
+                print("Traces can still be accessed after closing the reader!")
+                scenario_ok = False
+            if scenario_ok:
+                print("Traces match.")
+            ok = ok and scenario_ok
+            print("--------")
+    if ok:
+        print("All scenarios passed.")
+    else:
+        print("Some scenarios failed.")